@@ -4,34 +4,59 @@ import dash
 import dash_bootstrap_components as dbc
 from dash import dcc
 from dash import html
-from dash.dependencies import Input, Output, State
-import pandas as pd
-import pickle
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
+import argparse
+import flask
+import hashlib
+import plotly.graph_objs as go
+import threading
+import time
+import uuid
+from collections import OrderedDict
 
 
-from plots_api import facet_plot_over_interval, matrix_plot, origin_dest_plot, pie_plot_by_interval, plot_mean_arr_delay_per_dest, plot_mean_dep_delay_per_origin, plot_num_of_flights_facet, plot_reporting_airlines, \
-                      plot_routes, plot_scatter, plot_states_map, plot_textual, plot_x_places_by_interval
+from dimensions_api import get_dimension, get_places
+from executor_api import QueryCancelled, cancel_update, query_timeout, run_cancellable
+from plots_api import binary_figure, facet_plot_over_interval, matrix_plot, origin_dest_plot, pie_plot_by_interval, plot_mean_arr_delay_per_dest, plot_mean_dep_delay_per_origin, plot_num_of_flights_facet, plot_reporting_airlines, \
+                      plot_routes, preview_plot, plot_textual, plot_x_places_by_interval, scatter_store, states_store
 
-from spark_api import get_column_alias_key, get_column_aliases, get_dates, get_destinations, get_origins, load_cache, load_dataset
+from spark_api import NotCached, cached_only, cancellations_note, get_column_alias_key, get_column_aliases, get_dates, get_years, get_sample, load_cache, load_dataset, query_key, use_dataset
+from warmup import get_progress, places_shown, start_warmup
 
 
 ####### LOAD DATA #######
 
 cache = load_cache()
 df = load_dataset()
+# daily cube, prefix sums and cache of the query results of the dataset
+use_dataset(df, cache)
+# precompute the default and the popular states of the widgets in background
+start_warmup(df, cache)
 dates = get_dates()
-airports = pd.read_csv("util/airports.csv")
+years = get_years()
+# the airports of the dataset, by IATA code
+airports = get_dimension("airports")
 
 
 column_aliases_values = get_column_aliases().values()
 
+# marks of the date sliders: the first day of every year when the dataset
+# covers more than one, otherwise one every 60 days
+if len(years) > 1:
+    date_marks = {i: str(dates[i].year) for i in range(len(dates))
+                  if i == 0 or dates[i].year != dates[i - 1].year}
+else:
+    date_marks = {i: dates[i].strftime("%d-%m-%Y") for i in range(0, len(dates), 60)}
+year_marks = {year: str(year) for year in years}
+
 days = [1 for i in range(31)]
 months = {1:"Jan", 2:"Feb", 3:"March", 4:"April", 5:"May", 6:"June", 7:"July", 8:"August", 9:"September", 10:"October", 11:"November", 12:"December"}
 
-origins_states = get_origins("ORIGIN_STATE_FULL_NAME")
-origins_airports = get_origins("ORIGIN_AIRPORT_FULL_NAME")
-destinations_states = get_destinations("DEST_STATE_FULL_NAME")
-destinations_airports = get_destinations("DEST_AIRPORT_FULL_NAME")
+origins_states = get_places("ORIGIN_STATE_FULL_NAME")
+origins_airports = get_places("ORIGIN_AIRPORT_FULL_NAME")
+destinations_states = get_places("DEST_STATE_FULL_NAME")
+destinations_airports = get_places("DEST_AIRPORT_FULL_NAME")
 
 
 ####### APP LAYOUT #######
@@ -45,9 +70,18 @@ external_stylesheets = [
     dbc.themes.BOOTSTRAP
 ]
 
+# the responses are compressed with gzip or brotli if flask-compress is
+# installed (pip install dash[compress])
+try:
+    import flask_compress
+    compress = True
+except ImportError:
+    compress = False
+
 app = dash.Dash(__name__,
                 external_stylesheets=external_stylesheets,
                 eager_loading=True,
+                compress=compress,
                 )
 
 template = 'plotly_white'
@@ -115,6 +149,7 @@ plot1 = html.Div(
                                 'value': 'DepTimeBlk'},
                             {'label': 'Arrive time block', 'value':'ArrTimeBlk'},
                             {'label': 'Month', 'value': 'Month'},
+                            {'label': 'Year', 'value': 'Year'},
                             
                         ],
                         # add space beterrn the options
@@ -172,8 +207,7 @@ slider = html.Div(
             min=0,
             max=len(dates) - 1,
             value=[0, len(dates) - 1],
-            marks={i: dates[i].strftime("%d-%m-%Y")
-                   for i in range(0, len(dates), 60)},
+            marks=date_marks,
         ),
     ],
 )
@@ -241,8 +275,7 @@ slider_map = html.Div(
             min=0,
             max=len(dates) - 1,
             value=[0, len(dates) - 1],
-            marks={i: dates[i].strftime("%d-%m-%Y")
-                   for i in range(0, len(dates), 60)},
+            marks=date_marks,
         ),
     ],
 )
@@ -274,8 +307,7 @@ plot3 = html.Div(
                  html.H4('Select the origin'),
                  dcc.Dropdown(
                      id='origin-map-routes',
-                     options=[{'label': airports["AIRPORT"][i], 'value': airports["IATA"][i]}
-                              for i in range(len(airports["IATA"]))],
+                     options=[{'label': name, 'value': code} for code, name in airports.items()],
                      value='BOS',
                      clearable=False
                  ),
@@ -376,6 +408,8 @@ plot4 = html.Div(
                     figure={}
                 ),
         ),
+        # aggregate of the selected states, drawn by the browser
+        dcc.Store(id='states-store'),
     ]
 )
 
@@ -388,8 +422,7 @@ slider_airlines = html.Div(
             min=0,
             max=len(dates) - 1,
             value=[0, len(dates) - 1],
-            marks={i: dates[i].strftime("%d-%m-%Y")
-                   for i in range(0, len(dates), 60)},
+            marks=date_marks,
         ),
     ],
 )
@@ -452,7 +485,7 @@ option_scatter = [{"label" : "Arrival delay", "value" : "ArrDelay"},
                 {"label": "Taxi in time","value" :"TaxiIn"},
                 {"label": "Taxi out time","value" :"TaxiOut"},
                 {"label": "Air time","value" :"AirTime"},
-                {"label": "Distance","value" :"distance"}
+                {"label": "Distance","value" :"Distance"}
             ]
 
 # scatter plot
@@ -469,6 +502,7 @@ plot6 = html.Div(
                     options=[
                         {'label':'By day','value':'FlightDate'},
                         {'label':'By month','value':'Month'},
+                        {'label':'By year','value':'Year'},
                         {'label':'By day of week','value':'DayOfWeek'}
                     ],
                     style={'display': 'flex', 'flex-direction': 'column'},
@@ -524,6 +558,8 @@ plot6 = html.Div(
                     figure={}
                 ),
             ),
+            # aggregate of the selected granularity, drawn by the browser
+            dcc.Store(id='scatter-store'),
         ])
     ]
 )
@@ -537,8 +573,7 @@ slider_text = html.Div(
             min=0,
             max=len(dates) - 1,
             value=[0, len(dates) - 1],
-            marks={i: dates[i].strftime("%d-%m-%Y")
-                   for i in range(0, len(dates), 60)},
+            marks=date_marks,
         ),
     ],
 )
@@ -624,6 +659,14 @@ slider_pie = html.Div(
             max=len(months),
             marks=months
         ),
+        dcc.RangeSlider(
+            id='slider-year-pie',
+            min=years[0],
+            max=years[len(years) - 1],
+            step=1,
+            value=[years[0], years[len(years) - 1]],
+            marks=year_marks
+        ),
         
     ],
 )
@@ -644,6 +687,14 @@ slider_x_places = html.Div(
             max=len(months),
             marks=months
         ),
+        dcc.RangeSlider(
+            id='slider-year-x-places',
+            min=years[0],
+            max=years[len(years) - 1],
+            step=1,
+            value=[years[0], years[len(years) - 1]],
+            marks=year_marks
+        ),
         
     ],
 )
@@ -664,6 +715,14 @@ slider_facet_plot_x_places = html.Div(
             max=len(months),
             marks=months
         ),
+        dcc.RangeSlider(
+            id='slider-year-facet-x-places',
+            min=years[0],
+            max=years[len(years) - 1],
+            step=1,
+            value=[years[0], years[len(years) - 1]],
+            marks=year_marks
+        ),
     ],
 )
 
@@ -851,6 +910,7 @@ mean_arr_del_per_dest_plot = html.Div(
                             {'label': 'Daily', 'value': 'Daily'},
                             {'label': 'Weekly', 'value': 'Weekly'},
                             {'label': 'Monthly', 'value': 'Monthly'},
+                            {'label': 'Yearly', 'value': 'Yearly'},
                         ],
                         style={'display': 'flex', 'flex-direction': 'column'},
                         value="Daily"
@@ -858,6 +918,22 @@ mean_arr_del_per_dest_plot = html.Div(
             )
         ]),
         html.Br(),
+        dbc.Row([
+            html.Div(
+                dcc.RadioItems(
+                        id='statistic-arr-delay',
+                        options=[
+                            {'label': 'Mean', 'value': 'mean'},
+                            {'label': 'Median', 'value': 'p50'},
+                            {'label': '90th percentile', 'value': 'p90'},
+                            {'label': '99th percentile', 'value': 'p99'},
+                        ],
+                        style={'display': 'flex', 'flex-direction': 'column'},
+                        value="mean"
+                    ),
+            )
+        ]),
+        html.Br(),
         dbc.Row([
             html.Div(
                 dcc.Dropdown(
@@ -923,6 +999,7 @@ mean_dep_del_per_origin_plot = html.Div(
                             {'label': 'Daily', 'value': 'Daily'},
                             {'label': 'Weekly', 'value': 'Weekly'},
                             {'label': 'Monthly', 'value': 'Monthly'},
+                            {'label': 'Yearly', 'value': 'Yearly'},
                         ],
                         style={'display': 'flex', 'flex-direction': 'column'},
                         value="Daily"
@@ -930,6 +1007,22 @@ mean_dep_del_per_origin_plot = html.Div(
             )
         ]),
         html.Br(),
+        dbc.Row([
+            html.Div(
+                dcc.RadioItems(
+                        id='statistic-dep-delay',
+                        options=[
+                            {'label': 'Mean', 'value': 'mean'},
+                            {'label': 'Median', 'value': 'p50'},
+                            {'label': '90th percentile', 'value': 'p90'},
+                            {'label': '99th percentile', 'value': 'p99'},
+                        ],
+                        style={'display': 'flex', 'flex-direction': 'column'},
+                        value="mean"
+                    ),
+            )
+        ]),
+        html.Br(),
         dbc.Row([
             html.Div(
                 dcc.Dropdown(
@@ -1042,13 +1135,20 @@ flights_per_selected_place_plot = html.Div(
 
 ###### APP HEADER ########
 
+if len(years) > 1:
+    period_name = f"{years[0]}-{years[len(years) - 1]}"
+    period_text = f"the years from {years[0]} to {years[len(years) - 1]}"
+else:
+    period_name = str(years[0])
+    period_text = f"the entire year of {years[0]}"
+
 about_app = html.Div(
     children=[
         html.H2('About the Dashboard'),
-        html.P('''
-        Welcome to the 2013 Flight Data Dashboard! This interactive tool allows 
+        html.P(f'''
+        Welcome to the {period_name} Flight Data Dashboard! This interactive tool allows 
         you to explore and analyze flight data from across the United States for 
-        the entire year of 2013. With this dashboard, you can gain insights into 
+        {period_text}. With this dashboard, you can gain insights into 
         flight patterns, delays, and performance, as well as compare data across 
         different airlines and airports. Start by selecting your preferred filters 
         and then dive into the data using the various charts and graphs. 
@@ -1115,7 +1215,7 @@ cache_saver = html.Div(
 
 ##### COMPONING APP ######
 
-app.layout = html.Div(
+page = html.Div(
     className='flight-container',
     children=[
         html.Header(
@@ -1196,9 +1296,124 @@ app.layout = html.Div(
         flights_per_selected_place_plot
     ])
 
+# every page load gets its own session id: a new update of a widget cancels
+# only the queries of the same page (see run_widget)
+
+def serve_layout():
+    return html.Div(children=[dcc.Store(id='session-id', data=str(uuid.uuid4())), page])
+
+app.layout = serve_layout
+
 
 ###### CALLBACKS ########
 
+# run the queries of a widget update in their own spark job group: the update
+# still running for the same widget of the page is cancelled, and so is an
+# update that exceeds the timeout. The cancelled updates leave the plot as it is
+
+# time at which the last exact update of every (session, widget) ended
+finished_updates = OrderedDict()
+
+# etag of the exact figure the page of every (session, widget) is showing:
+# the hash of the cache key of the plot and its arguments, so an update that
+# would give the same figure isn't computed nor sent again
+sent_etags = OrderedDict()
+
+# the two maps are shared by the callback threads and keep only the last
+# updated_widgets (session, widget): the pages closed long ago are dropped
+updated_widgets = 10000
+updates_lock = threading.Lock()
+
+def remember(updates, key, value):
+    with updates_lock:
+        updates[key] = value
+        updates.move_to_end(key)
+        while len(updates) > updated_widgets:
+            updates.popitem(last=False)
+
+def recall(updates, key, default=None):
+    with updates_lock:
+        return updates.get(key, default)
+
+def forget(updates, key):
+    with updates_lock:
+        updates.pop(key, None)
+
+def figure_etag(plot, args):
+    return hashlib.sha1(query_key(plot, args).encode()).hexdigest()
+
+# the figures are sent with their data arrays in binary (see binary_figure)
+
+def compact(ret):
+    return binary_figure(ret) if isinstance(ret, go.Figure) else ret
+
+# seconds after which the queries of a widget update are cancelled, set with
+# python app.py --query-timeout N
+
+widget_timeout = query_timeout
+
+def run_widget(session_id, widget, function, *args):
+    # the first argument is the dataset
+    etag = figure_etag(function, args[1:])
+    flask.g.etags = flask.g.get('etags', []) + [etag]
+    if recall(sent_etags, (session_id, widget)) == etag:
+        # the update still running is superseded by the figure on the page
+        cancel_update(session_id, widget)
+        remember(finished_updates, (session_id, widget), time.monotonic())
+        raise PreventUpdate
+    try:
+        ret = run_cancellable(session_id, widget, function, *args, timeout=widget_timeout)
+    except QueryCancelled:
+        raise PreventUpdate
+    remember(finished_updates, (session_id, widget), time.monotonic())
+    remember(sent_etags, (session_id, widget), etag)
+    return compact(ret)
+
+# approximate figure of a widget update, shown until the exact one is ready;
+# it's dropped if the exact figure came first (e.g. from the cache) or if the
+# page already shows the exact one
+
+# whether the exact figure of plot can be drawn from the cached results alone
+
+def exact_cached(plot, args):
+    try:
+        cached_only(plot, df, *args)
+    except NotCached:
+        return False
+    return True
+
+def run_preview(session_id, widget, plot, *args):
+    if get_sample() is None or recall(sent_etags, (session_id, widget)) == figure_etag(plot, args):
+        cancel_update(session_id, widget + ' preview')
+        raise PreventUpdate
+    # the exact update is about to answer from the cache
+    if exact_cached(plot, args):
+        raise PreventUpdate
+    started = time.monotonic()
+    try:
+        ret = run_cancellable(session_id, widget + ' preview', preview_plot, plot, *args, timeout=widget_timeout)
+    except QueryCancelled:
+        raise PreventUpdate
+    if recall(finished_updates, (session_id, widget), float('-inf')) >= started:
+        raise PreventUpdate
+    # the page doesn't show the exact figure anymore
+    forget(sent_etags, (session_id, widget))
+    return compact(ret)
+
+# the callback responses carry the etag of their figures, the other responses
+# (the layout, the dependencies, ...) the hash of their content, and a request
+# with the same etag in If-None-Match gets 304 without the body
+
+@app.server.after_request
+def add_etag(response):
+    etags = flask.g.get('etags')
+    if etags:
+        response.set_etag(hashlib.sha1(' '.join(etags).encode()).hexdigest())
+    elif flask.request.method == 'GET' and response.status_code == 200 and not response.direct_passthrough \
+            and 'ETag' not in response.headers:
+        response.add_etag()
+    return response.make_conditional(flask.request)
+
 # cache saving
 
 @app.callback(
@@ -1206,9 +1421,22 @@ app.layout = html.Div(
     (Input('chache-timeout','n_intervals')),
 )
 def cache_save(n_intervals):
-    pickle.dump(cache,open('util/cache.pkl','wb'))
+    # only the entries added since the last save are written
+    cache.flush()
     return []
 
+# hit, miss and eviction counts of the cache
+
+@app.server.route('/cache-stats')
+def cache_stats():
+    return cache.stats()
+
+# progress of the warm-up
+
+@app.server.route('/warmup-progress')
+def warmup_progress():
+    return get_progress()
+
 
 # header button
 
@@ -1228,16 +1456,12 @@ def toggle_modal(n1, n2, is_open):
     [Output('matrix', 'figure'), Output('loading-1', 'parent_style')],
     [State('x-axis-1', 'value'),
         State('z-axis-1', 'value'),
-        Input('update-button-1', 'n_clicks')
+        Input('update-button-1', 'n_clicks'),
+        State('session-id', 'data')
      ])
-def update_graph(x_axis, z_axis, n_clicks):
+def update_graph(x_axis, z_axis, n_clicks, session_id):
     new_loading_style = loading_style
-    key = 'matrix1 '+str(x_axis)+' '+str(z_axis)
-    if key in cache:
-        ret = cache[key]
-    else:
-        ret = matrix_plot(df, x_axis, 'DayOfWeek', z_axis)
-        cache[key] = ret
+    ret = run_widget(session_id, 'matrix', matrix_plot, df, x_axis, 'DayOfWeek', z_axis)
 
     return ret, new_loading_style
 
@@ -1247,17 +1471,12 @@ def update_graph(x_axis, z_axis, n_clicks):
     [Output('pie-routes', 'figure'), Output('load-pie', 'parent_style')],
     [State('query-pie', 'value'),
         State('slider-2', 'value'),
-        Input('button-pie', 'n_clicks')
+        Input('button-pie', 'n_clicks'),
+        State('session-id', 'data')
      ])
-def update_graph(z_axis, date_range, n_clicks):
+def update_graph(z_axis, date_range, n_clicks, session_id):
     new_loading_style = loading_style
-    key = 'pie1 '+str(z_axis)+' '+str(date_range[0])+' '+str(date_range[1])
-    if key in cache:
-        ret = cache[key]
-    else:
-        ret = origin_dest_plot(
-            df, dates[date_range[0]], dates[date_range[1]], z_axis)
-        cache[key] = ret
+    ret = run_widget(session_id, 'pie-routes', origin_dest_plot, df, dates[date_range[0]], dates[date_range[1]], z_axis)
 
     return ret, new_loading_style
 
@@ -1269,82 +1488,80 @@ def update_graph(z_axis, date_range, n_clicks):
         State('air-state-map-routes', 'value'),
         State('slider-3', 'value'),
         State('query-map-routes', 'value'),
-        Input('button-map-routes', 'n_clicks')
+        Input('button-map-routes', 'n_clicks'),
+        State('session-id', 'data')
      ])
-def update_graph(origin, scope, date_range, query, n_clicks):
+def update_graph(origin, scope, date_range, query, n_clicks, session_id):
     title_text = 'Period: from ' + dates[date_range[0]].strftime('%d-%m-%Y') + ' to ' + dates[date_range[1]].strftime('%d-%m-%Y')
     new_loading_style = loading_style
-    key = 'map1 '+str(origin)+' '+str(scope) +' '+\
-        str(date_range[0])+' '+str(date_range[1])+' '+str(query)
-    if key in cache:
-        ret = cache[key]
-    else:
-        ret = plot_routes(df, dates[date_range[0]],
-                          dates[date_range[1]], origin, query, scope)
-        cache[key] = ret
+    ret = run_widget(session_id, 'map-routes', plot_routes, df, dates[date_range[0]], dates[date_range[1]], origin, query, scope)
 
     return ret, new_loading_style,title_text
 
-# update map states
+# update map states: the server sends the aggregate of origin or destination
+# states, the browser draws the selected query (see assets/clientside.js)
 
 @app.callback(
-    [Output('plot-state','figure'),Output('load-state','parent_style')],
+    [Output('states-store','data'),Output('load-state','parent_style')],
     [State('orig-dest-selector','value'),
-    State('query-state','value'),
-    Input('button-state','n_clicks')]
+    Input('button-state','n_clicks'),
+    State('session-id','data')]
 )
-def update_graph(orig_dest,query,n_clicks):
+def update_graph(orig_dest,n_clicks,session_id):
     new_loading_style = loading_style
-    key = 'state2 '+str(orig_dest)+' '+str(query)
-    if key in cache:
-        ret = cache[key]
-    else:
-        ret = plot_states_map(df,orig_dest,query)
-        cache[key] = ret
+    ret = run_widget(session_id,'plot-state',states_store,df,orig_dest)
 
     return ret, new_loading_style
 
+app.clientside_callback(
+    ClientsideFunction(namespace='flights', function_name='states_figure'),
+    Output('plot-state','figure'),
+    [Input('states-store','data'),
+    Input('query-state','value')]
+)
+
 # update airline reporting
 
 @app.callback(
     [Output('plot-airline','figure'),Output('load-airlines','parent_style'),Output('airline-period','children')],
     [State('query-airlines','value'),
     State('slider-4','value'),
-    Input('button-airlines','n_clicks')]
+    Input('button-airlines','n_clicks'),
+    State('session-id','data')]
 )
-def update_graph(query,date_range,n_clicks):
+def update_graph(query,date_range,n_clicks,session_id):
     title_text = 'Period: from ' + dates[date_range[0]].strftime('%d-%m-%Y') + ' to ' + dates[date_range[1]].strftime('%d-%m-%Y')
     new_loading_style = loading_style
-    key = 'airline1 '+str(query)+' '+str(date_range[0])+' '+str(date_range[1])        
-    if key in cache:
-        ret = cache[key]
-    else:
-        ret = plot_reporting_airlines(df,dates[date_range[0]],dates[date_range[1]],query)
-        cache[key] = ret
+    ret = run_widget(session_id,'plot-airline',plot_reporting_airlines,df,dates[date_range[0]],dates[date_range[1]],query)
     return ret, new_loading_style,title_text
 
-# update scatter
+# update scatter: the server sends all the measures of the granularity, the
+# browser draws the selected axes and colors
 
 @app.callback(
-    [Output('plot-scatter','figure'),Output('load-scatter','parent_style')],
+    [Output('scatter-store','data'),Output('load-scatter','parent_style')],
     [
         State('radio-scatter','value'),
-        State('x-scatter','value'),
-        State('y-scatter','value'),
-        State('z-scatter','value'),
-        Input('button-scatter','n_clicks')
+        Input('button-scatter','n_clicks'),
+        State('session-id','data')
     ]
 )
-def update_graph(time,x,y,z,n_clicks):
+def update_graph(time,n_clicks,session_id):
     new_loading_style = loading_style
-    key = 'scatter1 '+str(time)+' '+str(x)+' '+str(y)+' '+str(z)
-    if key in cache:
-        ret = cache[key]
-    else:
-        ret = plot_scatter(df,time,x,y,z)
-        cache[key]=ret
+    ret = run_widget(session_id,'plot-scatter',scatter_store,df,time)
     return ret,new_loading_style
 
+app.clientside_callback(
+    ClientsideFunction(namespace='flights', function_name='scatter_figure'),
+    Output('plot-scatter','figure'),
+    [
+        Input('scatter-store','data'),
+        Input('x-scatter','value'),
+        Input('y-scatter','value'),
+        Input('z-scatter','value')
+    ]
+)
+
 
 # update textual
 
@@ -1360,25 +1577,24 @@ def update_graph(time,x,y,z,n_clicks):
     ],
     [
         State('date-slider','value'),
-        Input('button-text','n_clicks')
+        Input('button-text','n_clicks'),
+        State('session-id','data')
     ]
 )
-def update_text(date_range,n_clics):
+def update_text(date_range,n_clics,session_id):
     title_text = 'Period: from ' + dates[date_range[0]].strftime('%d-%m-%Y') + ' to ' + dates[date_range[1]].strftime('%d-%m-%Y')
+    if cancellations_note(dates[date_range[0]],dates[date_range[1]]):
+        title_text += ' (cancelled and diverted flights: ' + cancellations_note(dates[date_range[0]],dates[date_range[1]]) + ')'
     new_loading_style = loading_style
-    key = 'text3 '+str(date_range[0])+' '+str(date_range[1])
-    if key in cache:
-        ret = cache[key]
-    else:
-        ret = plot_textual(df,dates[date_range[0]],dates[date_range[1]])
-        cache[key]=ret
+    ret = run_widget(session_id,'textual',plot_textual,df,dates[date_range[0]],dates[date_range[1]])
     ret = ret[:]
     for i in range(len(ret)):
         ret[i] = str(ret[i])
     ret[0] = '{:,}'.format(int(ret[0]))
-    ret[1] = '{:,}'.format(int(float(ret[1])))
+    # the cancelled and diverted flights are None out of the days they cover
+    ret[1] = '{:,}'.format(int(float(ret[1]))) if ret[1] != 'None' else 'not available'
     ret[2] = '{:,}'.format(int(ret[2]))
-    ret[3] = '{:,}'.format(int(float(ret[3])))
+    ret[3] = '{:,}'.format(int(float(ret[3]))) if ret[3] != 'None' else 'not available'
 
     if ret[4].find('.') != -1:
         ret[4] = ret[4][0:ret[4].find('.')+3]    
@@ -1391,11 +1607,13 @@ def update_text(date_range,n_clics):
     [Output('pie-plot', 'figure'), Output('loading-pie', 'parent_style')],
     [State('slider-1-pie', 'value'),
         State('slider-2-pie', 'value'),
+        State('slider-year-pie', 'value'),
         State('selected-place-column-type-by-pie', 'value'),
         State('sort-by-dropdown-pie', 'value'),
-        Input('button-pie-fil', 'n_clicks')
+        Input('button-pie-fil', 'n_clicks'),
+        State('session-id', 'data')
      ])
-def update_graph(selected_day, selected_month, selected_place_column, sort_by, n_clicks):
+def update_graph(selected_day, selected_month, selected_year, selected_place_column, sort_by, n_clicks, session_id):
     start_day = selected_day[0]
     end_day = selected_day[1]
     start_month, end_month = 1, 12
@@ -1405,13 +1623,9 @@ def update_graph(selected_day, selected_month, selected_place_column, sort_by, n
 
     new_loading_style = loading_style
     column_real_name = get_column_alias_key(selected_place_column)
-    key = str(start_day)+ ' '+str(end_day) + ' '+str(start_month) +' '+ str(end_month) + ' '+str(column_real_name) + ' '+str(sort_by) +' '+ "pie"
 
-    if key in cache:
-        ret = cache[key]
-    else:
-        ret = pie_plot_by_interval(df, 10, start_month, end_month, start_day, end_day, column_real_name, sort_by)
-        cache[key] = ret
+    ret = run_widget(session_id, 'pie-plot', pie_plot_by_interval, df, places_shown, start_month, end_month, start_day, end_day, column_real_name, sort_by,
+                     selected_year[0], selected_year[1])
 
     return ret, new_loading_style
 
@@ -1419,11 +1633,13 @@ def update_graph(selected_day, selected_month, selected_place_column, sort_by, n
     [Output('hist-x-plot', 'figure'), Output('loading-hist-x', 'parent_style')],
     [State('slider-1-x-places', 'value'),
         State('slider-2-x-places', 'value'),
+        State('slider-year-x-places', 'value'),
         State('selected-place-column-type-hist', 'value'),
         State('sort-by-dropdown-x-places', 'value'),
-        Input('button-hist-x', 'n_clicks')
+        Input('button-hist-x', 'n_clicks'),
+        State('session-id', 'data')
      ])
-def update_graph(selected_day, selected_month, selected_place_column, sort_by, n_clicks):
+def update_graph(selected_day, selected_month, selected_year, selected_place_column, sort_by, n_clicks, session_id):
     start_day = selected_day[0]
     end_day = selected_day[1]
     start_month, end_month = 1, 12
@@ -1433,13 +1649,9 @@ def update_graph(selected_day, selected_month, selected_place_column, sort_by, n
 
     new_loading_style = loading_style
     column_real_name = get_column_alias_key(selected_place_column)
-    key = str(start_day)+' '+ str(end_day) +' '+ str(start_month) +' '+ str(end_month) +' '+ str(column_real_name) + ' '+str(sort_by) +' '+ "hist"
 
-    if key in cache:
-        ret = cache[key]
-    else:
-        ret = plot_x_places_by_interval(df, 10, start_month, end_month, start_day, end_day, column_real_name, sort_by)
-        cache[key] = ret
+    ret = run_widget(session_id, 'hist-x-plot', plot_x_places_by_interval, df, places_shown, start_month, end_month, start_day, end_day, column_real_name, sort_by,
+                     selected_year[0], selected_year[1])
 
     return ret, new_loading_style
 
@@ -1447,11 +1659,13 @@ def update_graph(selected_day, selected_month, selected_place_column, sort_by, n
     [Output('facet-x-plot', 'figure'), Output('loading-facet-x', 'parent_style')],
     [State('slider-1-facet-x-places', 'value'),
         State('slider-2-facet-x-places', 'value'),
+        State('slider-year-facet-x-places', 'value'),
         State('selected-place-column-type-facet', 'value'),
         State('sort-by-dropdown-facet-x-places', 'value'),
-        Input('button-facet-x-places', 'n_clicks')
+        Input('button-facet-x-places', 'n_clicks'),
+        State('session-id', 'data')
      ])
-def update_graph(selected_day, selected_month, selected_place_column, sort_by, n_clicks):
+def update_graph(selected_day, selected_month, selected_year, selected_place_column, sort_by, n_clicks, session_id):
     start_day = selected_day[0]
     end_day = selected_day[1]
     start_month, end_month = 1, 12
@@ -1461,13 +1675,9 @@ def update_graph(selected_day, selected_month, selected_place_column, sort_by, n
     
     new_loading_style = loading_style
     column_real_name = get_column_alias_key(selected_place_column)
-    key = str(start_day)+' '+ str(end_day) +' '+ str(start_month) + ' '+str(end_month) + ' '+str(column_real_name) +' '+ str(sort_by) +' '+ "facet"
 
-    if key in cache:
-        ret = cache[key]
-    else:
-        ret = facet_plot_over_interval(df, 10, start_month, end_month, start_day, end_day, column_real_name, sort_by)
-        cache[key] = ret
+    ret = run_widget(session_id, 'facet-x-plot', facet_plot_over_interval, df, places_shown, start_month, end_month, start_day, end_day, column_real_name, sort_by,
+                     selected_year[0], selected_year[1])
 
     return ret, new_loading_style
 
@@ -1483,20 +1693,17 @@ def update_available_dest_dropdown_arr_delay(selected_dest_type):
 @app.callback(
     [Output('arr-delay-plot', 'figure'), Output('loading-arr-delay', 'parent_style')],
     [State('aggregation-level-arr-delay', 'value'),
+        State('statistic-arr-delay', 'value'),
         State('selected-dest-type-arr-del', 'value'),
         State('selected-dest-arr-del', 'value'),
-        Input('button-arr-delay', 'n_clicks')
+        Input('button-arr-delay', 'n_clicks'),
+        State('session-id', 'data')
      ])
-def update_graph(aggregation_level, dest_type, selected_dest, n_clicks):
+def update_graph(aggregation_level, statistic, dest_type, selected_dest, n_clicks, session_id):
     new_loading_style = loading_style
     dest_column_real_name = get_column_alias_key(dest_type)
-    key = str(aggregation_level) + ' '+str(dest_column_real_name) +' '+ str(selected_dest) + ' '+"arr-delay"
 
-    if key in cache:
-        ret = cache[key]
-    else:
-        ret = plot_mean_arr_delay_per_dest(df, selected_dest,  dest_column_real_name, aggregation_level)
-        cache[key] = ret
+    ret = run_widget(session_id, 'arr-delay-plot', plot_mean_arr_delay_per_dest, df, selected_dest, dest_column_real_name, aggregation_level, statistic)
     
     return ret, new_loading_style
 
@@ -1510,20 +1717,17 @@ def update_available_origins_dropdown(selected_origin_type):
 @app.callback(
     [Output('dep-delay-plot', 'figure'), Output('loading-dep-delay', 'parent_style')],
     [State('aggregation-level-dep-delay', 'value'),
+    State('statistic-dep-delay', 'value'),
     State('selected-origin-type-dep-del', 'value'),
     State('selected-origin-dep-del', 'value'),
-    Input('button-dep-delay', 'n_clicks')
+    Input('button-dep-delay', 'n_clicks'),
+    State('session-id', 'data')
     ])
-def update_graph(aggregation_level, origin_type, selected_origin, n_clicks):
+def update_graph(aggregation_level, statistic, origin_type, selected_origin, n_clicks, session_id):
     new_loading_style = loading_style
     origin_column_real_name = get_column_alias_key(origin_type)
-    key = str(aggregation_level) +' '+str(origin_column_real_name) +' '+str(selected_origin) +' '+ "dep-delay"
 
-    if key in cache:
-        ret = cache[key]
-    else:
-        ret = plot_mean_dep_delay_per_origin(df, selected_origin, origin_column_real_name, aggregation_level)
-        cache[key] = ret
+    ret = run_widget(session_id, 'dep-delay-plot', plot_mean_dep_delay_per_origin, df, selected_origin, origin_column_real_name, aggregation_level, statistic)
 
     return ret, new_loading_style
 
@@ -1545,23 +1749,87 @@ def update_available_dest_dropdown_time_series(selected_place_type):
     [Output('flights-per-selected-place-time-series-plot', 'figure'), Output('loading-flights-time-series', 'parent_style')],
     [State('selected-place-type-time-series', 'value'),
     State('selected-place-time-series', 'value'),
-    Input('button-flights-time-series', 'n_clicks')
+    Input('button-flights-time-series', 'n_clicks'),
+    State('session-id', 'data')
     ])
-def update_graph(place_column_type, selected_place, n_clicks):
+def update_graph(place_column_type, selected_place, n_clicks, session_id):
     new_loading_style = loading_style
     place_column_real_name = get_column_alias_key(place_column_type)
-    key = str(place_column_real_name)+' '+ str(selected_place) + ' '+"time-series"
 
-    if key in cache:
-        ret = cache[key]
-    else:
-        ret = plot_num_of_flights_facet(df, selected_place, place_column_real_name)
-        cache[key] = ret
+    ret = run_widget(session_id, 'time-series-plot', plot_num_of_flights_facet, df, selected_place, place_column_real_name)
     
     return ret, new_loading_style
 
+###### PREVIEWS ########
+
+# the same updates of the widgets that run spark queries, drawn on the sample
+
+def month_day_window(selected_day, selected_month):
+    start_month, end_month = 1, 12
+    if (selected_month is not None):
+        start_month, end_month = selected_month[0], selected_month[1]
+    return start_month, end_month, selected_day[0], selected_day[1]
+
+# arguments of the top/bottom places widgets from their sliders and dropdowns
+def places_arguments(selected_day, selected_month, selected_year, selected_place_column, sort_by):
+    return (places_shown, *month_day_window(selected_day, selected_month),
+            get_column_alias_key(selected_place_column), sort_by, selected_year[0], selected_year[1])
+
+# (widget, output, button, states, plot, arguments of plot from the values of
+# the states), with the widget names of run_widget
+previews = [
+    ('matrix', ('matrix', 'figure'), 'update-button-1', ['x-axis-1', 'z-axis-1'],
+        matrix_plot, lambda x_axis, z_axis: (x_axis, 'DayOfWeek', z_axis)),
+    ('pie-routes', ('pie-routes', 'figure'), 'button-pie', ['query-pie', 'slider-2'],
+        origin_dest_plot, lambda z_axis, date_range: (dates[date_range[0]], dates[date_range[1]], z_axis)),
+    ('map-routes', ('map-routes', 'figure'), 'button-map-routes',
+        ['origin-map-routes', 'air-state-map-routes', 'slider-3', 'query-map-routes'],
+        plot_routes, lambda origin, scope, date_range, query: (dates[date_range[0]], dates[date_range[1]], origin, query, scope)),
+    ('plot-state', ('states-store', 'data'), 'button-state', ['orig-dest-selector'],
+        states_store, lambda orig_dest: (orig_dest,)),
+    ('plot-scatter', ('scatter-store', 'data'), 'button-scatter', ['radio-scatter'],
+        scatter_store, lambda time: (time,)),
+    ('pie-plot', ('pie-plot', 'figure'), 'button-pie-fil',
+        ['slider-1-pie', 'slider-2-pie', 'slider-year-pie', 'selected-place-column-type-by-pie', 'sort-by-dropdown-pie'],
+        pie_plot_by_interval, places_arguments),
+    ('hist-x-plot', ('hist-x-plot', 'figure'), 'button-hist-x',
+        ['slider-1-x-places', 'slider-2-x-places', 'slider-year-x-places', 'selected-place-column-type-hist', 'sort-by-dropdown-x-places'],
+        plot_x_places_by_interval, places_arguments),
+    ('facet-x-plot', ('facet-x-plot', 'figure'), 'button-facet-x-places',
+        ['slider-1-facet-x-places', 'slider-2-facet-x-places', 'slider-year-facet-x-places', 'selected-place-column-type-facet',
+         'sort-by-dropdown-facet-x-places'],
+        facet_plot_over_interval, places_arguments),
+    ('arr-delay-plot', ('arr-delay-plot', 'figure'), 'button-arr-delay',
+        ['aggregation-level-arr-delay', 'statistic-arr-delay', 'selected-dest-type-arr-del', 'selected-dest-arr-del'],
+        plot_mean_arr_delay_per_dest,
+        lambda aggregation_level, statistic, dest_type, selected_dest: (selected_dest, get_column_alias_key(dest_type), aggregation_level, statistic)),
+    ('dep-delay-plot', ('dep-delay-plot', 'figure'), 'button-dep-delay',
+        ['aggregation-level-dep-delay', 'statistic-dep-delay', 'selected-origin-type-dep-del', 'selected-origin-dep-del'],
+        plot_mean_dep_delay_per_origin,
+        lambda aggregation_level, statistic, origin_type, selected_origin: (selected_origin, get_column_alias_key(origin_type), aggregation_level, statistic)),
+    ('time-series-plot', ('flights-per-selected-place-time-series-plot', 'figure'), 'button-flights-time-series',
+        ['selected-place-type-time-series', 'selected-place-time-series'],
+        plot_num_of_flights_facet, lambda place_column_type, selected_place: (selected_place, get_column_alias_key(place_column_type))),
+]
+
+def register_preview(widget, output, button, states, plot, arguments):
+    @app.callback(
+        Output(*output, allow_duplicate=True),
+        [Input(button, 'n_clicks'), State('session-id', 'data')] + [State(state, 'value') for state in states],
+        prevent_initial_call=True)
+    def preview_graph(n_clicks, session_id, *values):
+        return run_preview(session_id, widget, plot, *arguments(*values))
+
+for preview in previews:
+    register_preview(*preview)
+
 ##### APP RUN #######
 
 # run the app debug mode and 9000 port
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Dashboard of the US flights")
+    parser.add_argument("--query-timeout", type=float, default=query_timeout,
+                        help="seconds after which the queries of a widget update are cancelled")
+    arguments = parser.parse_args()
+    widget_timeout = arguments.query_timeout
     app.run_server(debug=True, port=9000)
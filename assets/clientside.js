@@ -0,0 +1,87 @@
+// figures of the widgets drawn in the browser from the aggregate shipped by
+// the server in a dcc.Store (see columnar_store in plots_api.py): changing the
+// metric or the axes redraws them here, without a request to the server
+
+const previewAnnotation = {
+    text: "Preview on a sample of the flights (with 95% error bounds), loading the exact result...",
+    xref: "paper", yref: "paper", x: 1, y: 1.08, showarrow: false,
+    font: {color: "grey"}
+};
+
+const scatterNames = {
+    "ArrDelay": " the average arrival delay ",
+    "DepDelay": " the average departure delay ",
+    "count": " the number of flights ",
+    "TaxiIn": " the average taxi in time ",
+    "TaxiOut": " the average taxi out time ",
+    "AirTime": " the average air time ",
+    "Distance": " the average distance "
+};
+
+// error bars of a column of the store: the previews carry the 95% error bounds
+// of their estimates in the <column>_error columns
+
+function errorBars(columns, column) {
+    const bounds = columns[column + "_error"];
+    return bounds ? {type: "data", array: bounds} : {visible: false};
+}
+
+function withPreview(store, layout) {
+    if (store.preview) {
+        layout.annotations = [previewAnnotation];
+    }
+    return layout;
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    flights: {
+        scatter_figure: function(store, x, y, z) {
+            if (!store) {
+                return window.dash_clientside.no_update;
+            }
+            const columns = store.columns;
+            const title = "Scatter plot with " + scatterNames[x] + " on the x-axis, " + scatterNames[y] +
+                          " on the y-axis and " + scatterNames[z] + " as the colormap.";
+            return {
+                data: [{
+                    type: "scatter", mode: "markers",
+                    x: columns[x], y: columns[y],
+                    error_x: errorBars(columns, x), error_y: errorBars(columns, y),
+                    text: columns[store.granularity],
+                    hovertemplate: store.granularity + "=%{text}<br>" + x + "=%{x}<br>" + y + "=%{y}<br>" +
+                                   z + "=%{marker.color}<extra></extra>",
+                    marker: {color: columns[z], colorscale: "Plasma", showscale: true, colorbar: {title: {text: z}}}
+                }],
+                layout: withPreview(store, {
+                    title: {text: title},
+                    xaxis: {title: {text: x}}, yaxis: {title: {text: y}}
+                })
+            };
+        },
+
+        states_figure: function(store, query) {
+            if (!store) {
+                return window.dash_clientside.no_update;
+            }
+            const columns = store.columns;
+            let title = query === "ArrDelay" ? "Average arrival delay " : "Number of flights ";
+            title += store.group === "ORIGIN_STATE" ? "by origin state " : "by destination state ";
+            const bounds = columns[query + "_error"];
+            return {
+                data: [{
+                    type: "choropleth", locationmode: "USA-states",
+                    locations: columns[store.group], z: columns[query],
+                    text: columns["State"],
+                    customdata: bounds,
+                    hovertemplate: "%{location}<br>State=%{text}<br>" + query + "=%{z}" +
+                                   (bounds ? " ± %{customdata:.1f}" : "") + "<extra></extra>",
+                    colorscale: "Plasma", colorbar: {title: {text: query}}
+                }],
+                layout: withPreview(store, {
+                    title: {text: title},
+                    geo: {scope: "usa"}
+                })
+            };
+        }
+    }
+});
@@ -0,0 +1,57 @@
+###### IMPORTS ########
+
+import sys
+import time
+
+sys.path.append(".")
+
+from query_api import skipping_stats
+from spark_api import compute_flights_per_selected_place, flights_per_selected_place_spec, get_dates, load_dataset, \
+                    routes_queries, routes_spec
+from storage_api import load_file_stats, parquet_exists
+
+###### BENCHMARK ########
+
+# files and bytes skipped by the point-origin queries on the clustered parquet
+# storage, with their timings. Run from the repository root, after
+# python storage_api.py (or python storage_api.py zorder Origin Dest):
+#   python benchmarks/data_skipping.py
+
+def timed(query):
+    start = time.perf_counter()
+    query().collect()
+    return time.perf_counter() - start
+
+def run(dates, repetitions=3):
+    # the dataset alone, without the cube, so the queries read the files
+    df = load_dataset("parquet")
+    queries = {
+        "routes_queries BOS month": (lambda: routes_queries(df, dates[0], dates[30], "BOS"), routes_spec()),
+        "routes_queries BOS year": (lambda: routes_queries(df, dates[0], dates[len(dates) - 1], "BOS"), routes_spec()),
+        "flights_per_selected_place BOS": (lambda: compute_flights_per_selected_place(df, "Origin", "BOS"),
+                                           flights_per_selected_place_spec("Origin")),
+        "flights_per_selected_place Utah": (lambda: compute_flights_per_selected_place(df, "ORIGIN_STATE_FULL_NAME", "Utah"),
+                                            flights_per_selected_place_spec("ORIGIN_STATE_FULL_NAME")),
+    }
+    results = {}
+    for name, (query, spec) in queries.items():
+        before = skipping_stats().get(spec, {"runs": 0, "skipped_files": 0, "skipped_bytes": 0, "files": 0, "bytes": 0})
+        seconds = min(timed(query) for _ in range(repetitions))
+        after = skipping_stats()[spec]
+        runs = after["runs"] - before["runs"]
+        results[name] = {"seconds": seconds,
+                         "files": (after["files"] - before["files"]) // runs,
+                         "skipped_files": (after["skipped_files"] - before["skipped_files"]) // runs,
+                         "bytes": (after["bytes"] - before["bytes"]) // runs,
+                         "skipped_bytes": (after["skipped_bytes"] - before["skipped_bytes"]) // runs}
+    return results
+
+
+if __name__ == "__main__":
+    if not parquet_exists() or load_file_stats() is None:
+        sys.exit("write the clustered dataset first: python storage_api.py")
+    results = run(get_dates())
+    print(f"{'query':<36}{'files':>8}{'skipped':>9}{'MB':>9}{'skipped MB':>12}{'time (s)':>10}")
+    for name, result in results.items():
+        print(f"{name:<36}{result['files']:>8}{result['skipped_files']:>9}{result['bytes']/2**20:>9.1f}"
+              f"{result['skipped_bytes']/2**20:>12.1f}{result['seconds']:>10.2f}")
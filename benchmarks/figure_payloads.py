@@ -0,0 +1,74 @@
+###### IMPORTS ########
+
+import gzip
+import json
+import sys
+
+sys.path.append(".")
+
+import plotly
+
+from plots_api import binary_figure, facet_plot_over_interval, matrix_plot, origin_dest_plot, pie_plot_by_interval, plot_mean_arr_delay_per_dest, \
+                    plot_mean_dep_delay_per_origin, plot_num_of_flights_facet, plot_reporting_airlines, plot_routes, plot_x_places_by_interval, \
+                    scatter_store, states_store
+from spark_api import get_dates, load_dataset, use_dataset
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+###### BENCHMARK ########
+
+# size of the figure of every widget in its default state: as plotly json, with
+# the binary data arrays of binary_figure, and both compressed as the app
+# sends them. The states map and the scatter send their columnar store, already
+# binary, that the browser draws. Run from the repository root:
+#   python benchmarks/figure_payloads.py
+
+def widgets(df, dates):
+    first, last = dates[0], dates[len(dates) - 1]
+    return {
+        "heatmap": lambda: matrix_plot(df, "Month", "DayOfWeek", "count"),
+        "pie routes": lambda: origin_dest_plot(df, first, last, "count"),
+        "map routes": lambda: plot_routes(df, first, last, "BOS", "NumFlights", "airports"),
+        "map states": lambda: states_store(df, "ORIGIN_STATE"),
+        "airlines": lambda: plot_reporting_airlines(df, first, last, "count"),
+        "scatter": lambda: scatter_store(df, "FlightDate"),
+        "pie places": lambda: pie_plot_by_interval(df, 10, 1, 12, 1, 31, "DEST_STATE_FULL_NAME", "Top"),
+        "histogram places": lambda: plot_x_places_by_interval(df, 10, 1, 12, 1, 31, "DEST_STATE_FULL_NAME", "Top"),
+        "facet places": lambda: facet_plot_over_interval(df, 10, 1, 12, 1, 31, "DEST_STATE_FULL_NAME", "Top"),
+        "arrival delay": lambda: plot_mean_arr_delay_per_dest(df, ["Utah"], "DEST_STATE_FULL_NAME", "Daily"),
+        "departure delay": lambda: plot_mean_dep_delay_per_origin(df, ["Utah"], "ORIGIN_STATE_FULL_NAME", "Daily"),
+        "time series": lambda: plot_num_of_flights_facet(df, "Utah", "ORIGIN_STATE_FULL_NAME"),
+    }
+
+def sizes(payload):
+    payload = payload.encode()
+    return {"raw": len(payload), "gzip": len(gzip.compress(payload)),
+            "brotli": len(brotli.compress(payload)) if brotli is not None else None}
+
+def run(df, dates):
+    results = {}
+    for name, plot in widgets(df, dates).items():
+        fig = plot()
+        if isinstance(fig, dict):
+            store = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+            results[name] = {"json": sizes(store), "binary": sizes(store)}
+            continue
+        results[name] = {"json": sizes(fig.to_json()),
+                         "binary": sizes(json.dumps(binary_figure(fig), cls=plotly.utils.PlotlyJSONEncoder))}
+    return results
+
+
+if __name__ == "__main__":
+    df = load_dataset()
+    use_dataset(df)
+    results = run(df, get_dates())
+    print(f"{'widget':<18}{'json KB':>9}{'binary KB':>11}{'saved':>7}{'json gzip':>11}{'binary gzip':>13}{'binary br':>11}")
+    for name, result in results.items():
+        json_size, binary_size = result["json"], result["binary"]
+        br = f"{binary_size['brotli']/1024:>11.1f}" if binary_size["brotli"] is not None else f"{'-':>11}"
+        print(f"{name:<18}{json_size['raw']/1024:>9.1f}{binary_size['raw']/1024:>11.1f}"
+              f"{1 - binary_size['raw']/json_size['raw']:>7.0%}{json_size['gzip']/1024:>11.1f}"
+              f"{binary_size['gzip']/1024:>13.1f}" + br)
@@ -0,0 +1,51 @@
+###### IMPORTS ########
+
+import random
+import sys
+import time
+
+sys.path.append(".")
+
+from spark_api import compute_x_places_by_interval, get_column_aliases, load_dataset, use_indexes, x_places_totals
+
+###### BENCHMARK ########
+
+# timings of the top/bottom-N places of random windows of months and days,
+# with the spark query on the raw flights and with the window indexes built
+# by use_indexes. Run from the repository root:
+#   python benchmarks/places_index.py [windows]
+
+def random_window():
+    start_month, end_month = sorted(random.sample(range(1, 13), 2))
+    start_day, end_day = sorted(random.sample(range(1, 32), 2))
+    return start_month, end_month, start_day, end_day
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+def run(df, windows):
+    results = {}
+    for place in get_column_aliases():
+        spark_times, index_times = [], []
+        for window in windows:
+            sort_by = random.choice(["Top", "Bottom"])
+            spark_times.append(timed(lambda: compute_x_places_by_interval(df, 10, *window, place, sort_by).toPandas()))
+            index_times.append(timed(lambda: x_places_totals(df, 10, *window, place, sort_by)))
+        results[place] = (sum(spark_times) / len(windows), sum(index_times) / len(windows))
+    return results
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    windows = [random_window() for _ in range(int(sys.argv[1]) if len(sys.argv) > 1 else 20)]
+    df = load_dataset()
+    start = time.perf_counter()
+    use_indexes(df)
+    print(f"indexes built in {time.perf_counter() - start:.2f} s")
+    # the first query warms up the jvm
+    compute_x_places_by_interval(df, 10, 1, 12, 1, 31, "Origin", "Top").toPandas()
+    print(f"{'place column':<30}{'spark (ms)':>12}{'index (ms)':>12}{'speedup':>10}")
+    for place, (spark_time, index_time) in run(df, windows).items():
+        print(f"{place:<30}{spark_time*1000:>12.1f}{index_time*1000:>12.2f}{spark_time/index_time:>9.0f}x")
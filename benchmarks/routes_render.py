@@ -0,0 +1,59 @@
+###### IMPORTS ########
+
+import sys
+import time
+
+sys.path.append(".")
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objs as go
+
+from plots_api import routes_figure
+
+###### BENCHMARK ########
+
+# build time and json payload of the routes map with one trace per route (as
+# plot_routes did) and with the single vectorized trace, on 100, 1,000 and
+# 10,000 random routes from Boston. Run from the repository root:
+#   python benchmarks/routes_render.py
+
+def random_routes(n, seed=42):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"ORIGIN_LATITUDE": np.full(n, 42.36), "ORIGIN_LONGITUDE": np.full(n, -71.01),
+                         "DEST_LATITUDE": rng.uniform(25, 49, n), "DEST_LONGITUDE": rng.uniform(-124, -67, n),
+                         "NumFlights": rng.integers(1, 3000, n), "DEST_NAME": [f"airport {i}" for i in range(n)]})
+
+# the map with a Scattergeo trace per route
+def per_route_figure(routes):
+    fig = go.Figure()
+    for slat, dlat, slon, dlon in zip(routes["ORIGIN_LATITUDE"], routes["DEST_LATITUDE"],
+                                      routes["ORIGIN_LONGITUDE"], routes["DEST_LONGITUDE"]):
+        fig.add_trace(go.Scattergeo(lat=[slat, dlat], lon=[slon, dlon], mode='lines',
+                                    line=dict(width=1, color="red"), hoverinfo="skip"))
+    fig.add_trace(go.Scattergeo(lon=routes["DEST_LONGITUDE"], lat=routes["DEST_LATITUDE"], mode='markers',
+                                text=routes["DEST_NAME"], hoverinfo='text'))
+    return fig
+
+def timed(build, routes):
+    start = time.perf_counter()
+    payload = build(routes.copy()).to_json()
+    return time.perf_counter() - start, len(payload)
+
+def run(sizes=(100, 1000, 10000)):
+    builds = {"per route": per_route_figure,
+              "single trace": lambda routes: routes_figure(routes),
+              "single trace, arcs": lambda routes: routes_figure(routes, arc_points=16)}
+    results = {}
+    for n in sizes:
+        routes = random_routes(n)
+        for name, build in builds.items():
+            results[(n, name)] = timed(build, routes)
+    return results
+
+
+if __name__ == "__main__":
+    results = run()
+    print(f"{'routes':<8}{'figure':<22}{'build + json (s)':>18}{'payload (KB)':>14}")
+    for (n, name), (seconds, size) in results.items():
+        print(f"{n:<8}{name:<22}{seconds:>18.3f}{size/1024:>14.0f}")
@@ -0,0 +1,51 @@
+###### IMPORTS ########
+
+import sys
+import time
+
+sys.path.append(".")
+
+from spark_api import get_dates, load_dataset, origin_dest_query, reporting_airlines_queries, routes_queries
+from storage_api import parquet_exists
+
+###### BENCHMARK ########
+
+# scan timings of the date-range queries on the csv and on the parquet storage.
+# Run from the repository root, after python storage_api.py:
+#   python benchmarks/storage_scan.py
+
+def timed(query):
+    start = time.perf_counter()
+    query().collect()
+    return time.perf_counter() - start
+
+def run(storage, dates, repetitions=3):
+    df = load_dataset(storage)
+    # one month, one quarter and the whole year
+    ranges = {"month": (dates[0], dates[30]), "quarter": (dates[0], dates[89]),
+              "year": (dates[0], dates[len(dates) - 1])}
+    results = {}
+    for name, (from_date, to_date) in ranges.items():
+        queries = {
+            "full scan": lambda: df.filter(df["FlightDate"].between(from_date, to_date)).groupBy().count(),
+            "origin_dest_query": lambda: origin_dest_query(df, from_date, to_date, "count"),
+            "routes_queries": lambda: routes_queries(df, from_date, to_date, "BOS"),
+            "reporting_airlines_queries": lambda: reporting_airlines_queries(df, from_date, to_date),
+        }
+        for query_name, query in queries.items():
+            # the first run warms up the jvm and the file listing
+            timed(query)
+            results[(name, query_name)] = min(timed(query) for _ in range(repetitions))
+    return results
+
+
+if __name__ == "__main__":
+    if not parquet_exists():
+        sys.exit("convert the dataset first: python storage_api.py")
+    dates = get_dates()
+    before = run("csv", dates)
+    after = run("parquet", dates)
+    print(f"{'range':<10}{'query':<30}{'csv (s)':>10}{'parquet (s)':>14}{'speedup':>10}")
+    for (range_name, query_name), csv_time in before.items():
+        parquet_time = after[(range_name, query_name)]
+        print(f"{range_name:<10}{query_name:<30}{csv_time:>10.2f}{parquet_time:>14.2f}{csv_time/parquet_time:>9.1f}x")
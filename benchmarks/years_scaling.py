@@ -0,0 +1,60 @@
+###### IMPORTS ########
+
+import sys
+import time
+
+sys.path.append(".")
+
+import pyspark.sql.functions as F
+
+from spark_api import compute_x_places_by_interval, get_dates, get_years, load_dataset, matrix_agg, origin_dest_query, routes_queries, use_dates
+from storage_api import parquet_exists
+
+###### BENCHMARK ########
+
+# latency of the queries on the first 1, 2, ... years of the parquet storage
+# (up to the ten of 2013-2023): the queries on a single year read only its
+# partitions and should not grow with the dataset, the ones on all the years
+# grow linearly. Run from the repository root, after python storage_api.py:
+#   python benchmarks/years_scaling.py
+
+def timed(query):
+    start = time.perf_counter()
+    query().collect()
+    return time.perf_counter() - start
+
+def run(df, years, repetitions=3):
+    dates = get_dates()
+    first_year = dates[dates.dt.year == years[0]]
+    first_year = (first_year.iloc[0], first_year.iloc[len(first_year) - 1])
+    results = {}
+    for n in range(1, len(years) + 1):
+        # the dataset restricted to its first n years (a filter on the partitions)
+        subset = df.filter(F.col("Year") <= years[n - 1])
+        last = dates[dates.dt.year <= years[n - 1]]
+        everything = (last.iloc[0], last.iloc[len(last) - 1])
+        queries = {
+            "origin_dest_query first year": lambda: origin_dest_query(subset, *first_year, "count"),
+            "origin_dest_query all years": lambda: origin_dest_query(subset, *everything, "count"),
+            "routes_queries BOS all years": lambda: routes_queries(subset, *everything, "BOS"),
+            "matrix_agg Month x DayOfWeek": lambda: matrix_agg(subset, "Month", "DayOfWeek", "count"),
+            "x_places Jan 1-15 all years": lambda: compute_x_places_by_interval(subset, 10, 1, 1, 1, 15, "Origin", "Top",
+                                                                               years[0], years[n - 1]),
+        }
+        for query_name, query in queries.items():
+            # the first run warms up the jvm and the file listing
+            timed(query)
+            results[(n, query_name)] = min(timed(query) for _ in range(repetitions))
+    return results
+
+
+if __name__ == "__main__":
+    if not parquet_exists():
+        sys.exit("convert the dataset first: python storage_api.py")
+    df = load_dataset("parquet")
+    use_dates(df)
+    years = get_years()[:10]
+    results = run(df, years)
+    print(f"{'years':<7}{'query':<34}{'time (s)':>10}")
+    for (n, query_name), seconds in results.items():
+        print(f"{n:<7}{query_name:<34}{seconds:>10.2f}")
@@ -0,0 +1,349 @@
+###### IMPORTS ########
+
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from executor_api import QueryCancelled, check_cancelled
+
+###### CONSTANTS ########
+
+# default memory budget of the callback cache, in bytes
+cache_max_bytes = 256 * 1024 * 1024
+
+# seconds between two checks of the cancellation of a waiting caller
+wait_interval = 0.5
+
+# on-disk store of the cache, with its own budget (enforced by the compaction)
+store_path = "util/cache.sqlite"
+store_max_bytes = 1024 * 1024 * 1024
+compaction_interval = 10 * 60
+# seconds a write waits for the vacuum of the compaction
+store_timeout = 120
+
+###### FUNCTIONS ########
+
+# size of a cached value, measured as the length of its pickle (that is also
+# what the cache costs on disk). The values that can't be pickled are estimated
+# from their memory, so they still count against the budget
+
+def entry_size(value):
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        if hasattr(value, "memory_usage"):
+            # a number for the series, one per column for the dataframes
+            usage = value.memory_usage(deep=True)
+            return int(usage.sum() if hasattr(usage, "sum") else usage)
+        return sys.getsizeof(value)
+
+###### CACHE ########
+
+# a computation in progress: the callers that ask for the same key wait for
+# its value (or its error) instead of running it again
+
+class Flight:
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+    def land(self, value=None, error=None):
+        self.value = value
+        self.error = error
+        self.event.set()
+
+    # check is called every wait_interval seconds while waiting, so a caller
+    # cancelled in the meantime (e.g. timed out) stops waiting with its error
+
+    def wait(self, check=None):
+        while not self.event.wait(wait_interval if check is not None else None):
+            check()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+# cache of the callback results bounded by a memory budget: when the budget is
+# exceeded the least recently used (policy="lru") or the least frequently used
+# (policy="lfu") entries are evicted, and every entry can expire after ttl
+# seconds. All the operations hold a lock, since Dash serves the callbacks
+# from several threads
+
+class ResultCache:
+
+    def __init__(self, max_bytes=cache_max_bytes, policy="lru", ttl=None, store=None):
+        if policy not in ("lru", "lfu"):
+            raise ValueError("unknown eviction policy: " + str(policy))
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.ttl = ttl
+        # entries missing from memory are looked up in the store, and the new
+        # ones are written to it by flush
+        self.store = store
+        # key -> (value, expiration timestamp) of the entries not flushed yet
+        self.dirty = {}
+        self.lock = threading.RLock()
+        # key -> [value, size, expiration time, number of uses], in LRU order
+        self.entries = OrderedDict()
+        # key -> Flight of the values being computed
+        self.inflight = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+
+    def __contains__(self, key):
+        with self.lock:
+            return self._live_entry(key) is not None
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self._live_entry(key)
+            if entry is not None:
+                self.hits += 1
+                entry[3] += 1
+                self.entries.move_to_end(key)
+                return entry[0]
+        # lazy load from the store, outside the lock
+        stored = self.store.get(key) if self.store is not None else None
+        with self.lock:
+            if stored is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            value, size, expiration = stored
+            ttl = expiration - time.time() if expiration is not None else None
+            self._insert(key, value, size, ttl)
+            return value
+
+    def put(self, key, value, ttl=None, size=None):
+        size = entry_size(value) if size is None else size
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            self._insert(key, value, size, ttl)
+            self.dirty[key] = (value, time.time() + ttl if ttl is not None else None)
+
+    # write the entries added since the last flush to the store
+
+    def flush(self):
+        if self.store is None:
+            return 0
+        with self.lock:
+            pending = [(key, value, expiration) for key, (value, expiration) in self.dirty.items()]
+            self.dirty = {}
+        self.store.put_many(pending)
+        return len(pending)
+
+    def _insert(self, key, value, size, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        expiration = time.monotonic() + ttl if ttl is not None else None
+        self._remove(key)
+        # a value larger than the whole budget is not cached at all
+        if size > self.max_bytes:
+            return
+        self.entries[key] = [value, size, expiration, 1]
+        self.size += size
+        while self.size > self.max_bytes:
+            self._remove(self._victim())
+            self.evictions += 1
+
+    # the result of key, computed (outside the lock) and cached on a miss.
+    # Concurrent misses on the same key are coalesced: the first caller runs
+    # compute and the others wait for its result, or get its error. If that
+    # computation was cancelled (its request was superseded or timed out) the
+    # waiters try again
+
+    def get_or_compute(self, key, compute, ttl=None):
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+        mine, others = self.claim([key])
+        if key in others:
+            try:
+                return others[key].wait(check_cancelled)
+            except QueryCancelled:
+                # the query isn't run again for a caller cancelled itself
+                check_cancelled()
+                return self.get_or_compute(key, compute, ttl)
+        # another caller may have computed and released the key between the
+        # miss and the claim: its value is already cached
+        with self.lock:
+            entry = self._live_entry(key)
+        if entry is not None:
+            self.release(key, entry[0])
+            return entry[0]
+        try:
+            value = compute()
+        except Exception as error:
+            self.release(key, error=error)
+            raise
+        self.put(key, value, ttl)
+        self.release(key, value)
+        return value
+
+    # mark as in flight the keys that nobody is computing: returns them (the
+    # caller must compute, put and release them) and the flights of the keys
+    # already computed by someone else
+
+    def claim(self, keys):
+        mine, others = [], {}
+        with self.lock:
+            for key in keys:
+                if key in self.inflight:
+                    others[key] = self.inflight[key]
+                    self.coalesced += 1
+                else:
+                    self.inflight[key] = Flight()
+                    mine.append(key)
+        return mine, others
+
+    def release(self, key, value=None, error=None):
+        with self.lock:
+            flight = self.inflight.pop(key, None)
+        if flight is not None:
+            flight.land(value, error)
+
+    def items(self):
+        with self.lock:
+            return [(key, entry[0]) for key, entry in self.entries.items()
+                    if not self._expired(entry)]
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.size,
+                    "max_bytes": self.max_bytes, "policy": self.policy,
+                    "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "expirations": self.expirations,
+                    "coalesced": self.coalesced, "in_flight": len(self.inflight)}
+
+    def _expired(self, entry):
+        return entry[2] is not None and entry[2] <= time.monotonic()
+
+    def _live_entry(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and self._expired(entry):
+            self._remove(key)
+            self.expirations += 1
+            return None
+        return entry
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def _victim(self):
+        if self.policy == "lru":
+            return next(iter(self.entries))
+        # least used entry, the least recently used among the ties
+        return min(self.entries, key=lambda key: self.entries[key][3])
+
+
+###### PERSISTENT STORE ########
+
+# keyed on-disk store of the cache entries, in a sqlite database: every flush
+# writes only the new entries in a single transaction, so a crash in the middle
+# of a write leaves the previous content intact. The entries are read one by
+# one when they are requested (their last use is written with the next flush
+# or compaction), and a background thread periodically drops the least
+# recently used ones beyond max_bytes and, if it dropped any, compacts the
+# file on its own connection: thanks to the WAL the reads go on meanwhile
+
+class CacheStore:
+
+    def __init__(self, path=store_path, max_bytes=store_max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # key -> time of the last read, not written yet
+        self.used = {}
+        self.connection = sqlite3.connect(path, timeout=store_timeout, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS entries ("
+                                    "key TEXT PRIMARY KEY, value BLOB, size INTEGER, "
+                                    "used REAL, expiration REAL)")
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    # (value, size, expiration) of key, None if it's not stored or expired
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT value, size, expiration FROM entries "
+                                          "WHERE key = ? AND (expiration IS NULL OR expiration > ?)",
+                                          (key, now)).fetchone()
+            if row is None:
+                return None
+            self.used[key] = now
+        try:
+            return pickle.loads(row[0]), row[1], row[2]
+        except Exception:
+            return None
+
+    # items are (key, value, expiration timestamp or None)
+
+    def put_many(self, items):
+        rows = []
+        for key, value, expiration in items:
+            try:
+                blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                continue
+            rows.append((key, sqlite3.Binary(blob), len(blob), time.time(), expiration))
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", rows)
+            self._write_used()
+
+    # the last uses of the entries read since the last write, in the current
+    # transaction (the lock must be held)
+
+    def _write_used(self):
+        used = [(when, key) for key, when in self.used.items()]
+        self.used = {}
+        self.connection.executemany("UPDATE entries SET used = ? WHERE key = ?", used)
+
+    def compact(self):
+        with self.lock, self.connection:
+            self._write_used()
+            removed = self.connection.execute("DELETE FROM entries WHERE expiration <= ?", (time.time(),)).rowcount
+            rows = self.connection.execute("SELECT key, size FROM entries ORDER BY used DESC").fetchall()
+            total, stale = 0, []
+            for key, size in rows:
+                total += size
+                if total > self.max_bytes:
+                    stale.append((key,))
+            self.connection.executemany("DELETE FROM entries WHERE key = ?", stale)
+        removed += len(stale)
+        # the file is rewritten only if something was dropped, without the lock
+        if removed > 0:
+            connection = sqlite3.connect(self.path, timeout=store_timeout)
+            try:
+                connection.execute("VACUUM")
+                connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            finally:
+                connection.close()
+        return removed
+
+    def start_compaction(self, interval=compaction_interval):
+        def run():
+            while True:
+                time.sleep(interval)
+                self.compact()
+        thread = threading.Thread(target=run, name="cache-compaction", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,133 @@
+###### IMPORTS ########
+
+import os
+import pyspark.sql.functions as F
+
+###### CONSTANTS ########
+
+cube_path = "data.nosync/cleaned/flights_cube.parquet"
+
+# grain of the cube: one row per day, route and airline
+cube_keys = ["FlightDate", "Origin", "Dest", "Reporting_Airline"]
+
+# columns that depend only on the grain keys (calendar of FlightDate, geography
+# of Origin and Dest): grouping also by them doesn't add rows to the cube
+cube_attributes = ["Year", "Month", "DayofMonth", "DayOfWeek", "WeekofMonth",
+                   "ORIGIN_STATE", "ORIGIN_STATE_FULL_NAME", "ORIGIN_AIRPORT_FULL_NAME",
+                   "ORIGIN_LATITUDE", "ORIGIN_LONGITUDE",
+                   "DEST_STATE", "DEST_STATE_FULL_NAME", "DEST_AIRPORT_FULL_NAME",
+                   "DEST_LATITUDE", "DEST_LONGITUDE"]
+
+# mergeable measures, stored as sums next to the number of flights
+cube_measures = ["ArrDelay", "DepDelay", "ArrDelayMinutes", "DepDelayMinutes",
+                 "TaxiIn", "TaxiOut", "AirTime", "Distance", "DepTime", "ArrTime",
+                 "Cancelled", "Diverted"]
+
+# the registered cube and the dataset it was built from
+cube = None
+cube_source = None
+
+# stratified sample with the layout of the cube, see sample_api.py
+sample = None
+
+###### FUNCTIONS ########
+
+def build_cube(df):
+    aggregations = [F.count(F.lit(1)).alias("count")]
+    aggregations += [F.sum(measure).alias(measure + "_sum") for measure in cube_measures]
+    return df.groupBy(*(cube_keys + cube_attributes)).agg(*aggregations)
+
+def save_cube(cube_df, path=cube_path):
+    cube_df.write.mode("overwrite").partitionBy("Year", "Month").parquet(path)
+
+# read the materialized cube if it exists, otherwise build it from df and
+# keep it in memory (it is a few hundred thousand rows)
+
+def load_cube(spark, df, path=cube_path):
+    if os.path.isdir(path):
+        cube_df = spark.read.parquet(path)
+    else:
+        cube_df = build_cube(df)
+    return cube_df.cache()
+
+def register_cube(cube_df, df):
+    global cube, cube_source
+    cube = cube_df
+    cube_source = df
+
+def register_sample(sample_df):
+    global sample
+    sample = sample_df
+
+# queries are routed to the cube only if they run on the dataset the cube was
+# built from and every column they use is a dimension or a measure of the cube.
+# The queries on the sample read it as a cube, since its rows carry weights
+
+def covers(columns):
+    return all(column in cube_keys or column in cube_attributes or column in cube_measures
+               for column in columns)
+
+def get_source(df, columns):
+    if sample is not None and df is sample:
+        return sample, True
+    if cube is not None and df is cube_source and covers(columns):
+        return cube, True
+    return df, False
+
+# keep only the columns a query needs; on the cube a measure is read through
+# its sum, and the number of flights is always needed
+
+def project(source, columns, from_cube):
+    if not from_cube:
+        return source.select(*columns)
+    selected = [column for column in columns if column not in cube_measures]
+    selected += [column + "_sum" for column in columns if column in cube_measures]
+    return source.select(*(selected + ["count"]))
+
+# aggregation expressions that give the same result on the raw flights and on
+# the cube
+
+def count_measure(from_cube, alias="count"):
+    if from_cube:
+        return F.sum("count").alias(alias)
+    return F.count(F.lit(1)).alias(alias)
+
+def sum_measure(column, from_cube, alias=None):
+    alias = alias or column
+    if from_cube:
+        return F.sum(column + "_sum").alias(alias)
+    return F.sum(column).alias(alias)
+
+# averages of attributes (e.g. the coordinates) are weighted by the number of
+# flights, as they would be on the raw rows
+
+def avg_measure(column, from_cube, alias=None):
+    alias = alias or column
+    if not from_cube:
+        return F.avg(column).alias(alias)
+    if column in cube_measures:
+        return (F.sum(column + "_sum") / F.sum("count")).alias(alias)
+    return (F.sum(F.col(column) * F.col("count")) / F.sum("count")).alias(alias)
+
+# the same measures as spark sql expressions, kind is "count", "sum" or "avg"
+
+def measure_sql(kind, column, from_cube):
+    if kind == "count":
+        return "SUM(`count`)" if from_cube else "COUNT(1)"
+    if kind == "sum":
+        return f"SUM(`{column}_sum`)" if from_cube else f"SUM(`{column}`)"
+    if not from_cube:
+        return f"AVG(`{column}`)"
+    if column in cube_measures:
+        return f"SUM(`{column}_sum`) / SUM(`count`)"
+    return f"SUM(`{column}` * `count`) / SUM(`count`)"
+
+
+##### CUBE MATERIALIZATION #######
+
+# python cube_api.py
+if __name__ == "__main__":
+    from spark_api import load_dataset
+
+    save_cube(build_cube(load_dataset()))
+    print("written", cube_path)
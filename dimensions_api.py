@@ -0,0 +1,79 @@
+###### IMPORTS ########
+
+import pandas as pd
+
+###### CONSTANTS ########
+
+states_path = "util/states.csv"
+airports_path = "util/airports.csv"
+airlines_path = "util/airlines.csv"
+
+# place columns of the dropdowns of the widgets
+place_columns = ["ORIGIN_STATE_FULL_NAME", "ORIGIN_AIRPORT_FULL_NAME", "DEST_STATE_FULL_NAME", "DEST_AIRPORT_FULL_NAME"]
+
+# columns of the ends of the routes read by register_dimensions
+route_ends = {"Origin": ("ORIGIN_STATE", "ORIGIN_STATE_FULL_NAME", "ORIGIN_AIRPORT_FULL_NAME"),
+              "Dest": ("DEST_STATE", "DEST_STATE_FULL_NAME", "DEST_AIRPORT_FULL_NAME")}
+
+###### TABLES ########
+
+# name of every state, by abbreviation (e.g. CA -> California)
+
+def read_states(path=states_path):
+    states = pd.read_csv(path, delimiter="\t", header=None, names=["State", "unk", "Abbreviation"])
+    return states.set_index("Abbreviation")["State"]
+
+# name of every airport, by IATA code
+
+def read_airports(path=airports_path):
+    return pd.read_csv(path).set_index("IATA")["AIRPORT"]
+
+# name of every airline, by IATA code. The table is world-wide and some codes
+# belong to several airlines (e.g. CP, G7): the active US ones come first
+
+def read_airlines(path=airlines_path):
+    airlines = pd.read_csv(path)
+    airlines = airlines.assign(us=airlines["Country"] != "United States", inactive=airlines["Active"] != "Y").\
+                    sort_values(["us", "inactive"], kind="stable")
+    return airlines.drop_duplicates("IATA").set_index("IATA")["Name"]
+
+###### REGISTRY ########
+
+# the tables, read once, and the registry: code -> name of the airports, states
+# and airlines, and the values of the place columns. Until register_dimensions
+# restricts them to the codes of the dataset they are the whole tables
+tables = {"states": read_states(), "airports": read_airports(), "airlines": read_airlines()}
+dimensions = dict(tables)
+places = {column: [] for column in place_columns}
+
+# restrict the registry to the codes of the flights: routes has a row for every
+# (Origin, Dest) with the columns of route_ends, airlines the Reporting_Airline
+# codes. The codes missing from the tables are named as in the dataset (or by
+# their code, for the airlines)
+
+def register_dimensions(routes, airlines):
+    ends = [routes[[code, *columns]].set_axis(["code", "state", "state_name", "airport_name"], axis=1)
+                for code, columns in route_ends.items()]
+    ends = pd.concat(ends, ignore_index=True)
+
+    airports = ends.drop_duplicates("code").set_index("code")["airport_name"].sort_index()
+    states = ends.drop_duplicates("state").set_index("state")["state_name"].sort_index()
+    codes = pd.Index(sorted(airlines["Reporting_Airline"].unique()))
+    dimensions["airports"] = tables["airports"].reindex(airports.index).fillna(airports)
+    dimensions["states"] = tables["states"].reindex(states.index).fillna(states)
+    dimensions["airlines"] = tables["airlines"].reindex(codes).fillna(codes.to_series())
+
+    for column in place_columns:
+        places[column] = sorted(routes[column].dropna().unique())
+
+def get_dimension(dimension):
+    return dimensions[dimension]
+
+def get_places(column):
+    return places[column]
+
+# names of a column of codes, as a lookup in the registry (the codes without a
+# name keep their code)
+
+def labels(codes, dimension):
+    return codes.map(dimensions[dimension]).fillna(codes)
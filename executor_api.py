@@ -0,0 +1,160 @@
+###### IMPORTS ########
+
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pyspark import SparkContext
+
+###### CONSTANTS ########
+
+# scheduler pools defined in util/fairscheduler.xml
+interactive_pool = "interactive"
+background_pool = "background"
+
+# threads that run independent queries side by side (see run_parallel)
+executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="spark-query")
+
+# default seconds after which the spark jobs of a widget update are cancelled
+# (python app.py --query-timeout N)
+query_timeout = 120
+
+# job group of the running update of every (session, widget), and the groups
+# cancelled because superseded by a newer update or timed out
+active_groups = {}
+cancelled_groups = set()
+groups_lock = threading.Lock()
+group_ids = itertools.count()
+
+###### FUNCTIONS ########
+
+# raised in place of the spark error by the updates whose jobs were cancelled
+
+class QueryCancelled(Exception):
+    pass
+
+# run function(*args) with its spark jobs in the FAIR scheduler pool
+
+def in_pool(pool, function, *args):
+    context = SparkContext.getOrCreate()
+    context.setLocalProperty("spark.scheduler.pool", pool)
+    try:
+        return function(*args)
+    finally:
+        context.setLocalProperty("spark.scheduler.pool", None)
+
+# run function(*args) with its spark jobs in the job group (None for no group);
+# cancelling the group interrupts the tasks already running on the executors
+
+def in_group(group, function, *args):
+    if group is None:
+        return function(*args)
+    context = SparkContext.getOrCreate()
+    context.setJobGroup(group, group, interruptOnCancel=True)
+    try:
+        return function(*args)
+    finally:
+        context.setLocalProperty("spark.jobGroup.id", None)
+        context.setLocalProperty("spark.job.description", None)
+        context.setLocalProperty("spark.job.interruptOnCancel", None)
+
+def current_group():
+    return SparkContext.getOrCreate().getLocalProperty("spark.jobGroup.id")
+
+# the tasks keep the job group of the thread that submits them, so they are
+# cancelled together with it
+
+def submit(function, *args, pool=interactive_pool):
+    return executor.submit(in_pool, pool, in_group, current_group(), function, *args)
+
+# run independent tasks (function, args) at the same time and return their
+# results in the same order; the first error is raised once all of them end
+
+def run_parallel(tasks, pool=interactive_pool):
+    futures = [submit(function, *args, pool=pool) for function, args in tasks]
+    errors = [future.exception() for future in futures]
+    for error in errors:
+        if error is not None:
+            raise error
+    return [future.result() for future in futures]
+
+# cancelJobGroup only stops the jobs already submitted: the queries call
+# check_cancelled before starting a new job, so a cancelled update stops there
+
+def check_cancelled():
+    group = current_group()
+    if group is None:
+        return
+    with groups_lock:
+        if group in cancelled_groups:
+            raise QueryCancelled(group)
+
+# the error of a job of the current group: QueryCancelled if the group was
+# cancelled (with the error of the interrupted spark job as its cause), so the
+# callers waiting for the same result know they can run it again
+
+def as_cancelled(error):
+    group = current_group()
+    if group is None or isinstance(error, QueryCancelled):
+        return error
+    with groups_lock:
+        if group not in cancelled_groups:
+            return error
+    cancelled = QueryCancelled(group)
+    cancelled.__cause__ = error
+    return cancelled
+
+# cancel the group of an update still running (the timer of an update can fire
+# while it ends, after its group has been dropped)
+
+def cancel_group(group):
+    with groups_lock:
+        if group not in active_groups.values():
+            return
+        cancelled_groups.add(group)
+    SparkContext.getOrCreate().cancelJobGroup(group)
+
+# cancel the update still running for widget and session, e.g. when a newer
+# one is answered without running any query
+
+def cancel_update(session, widget):
+    with groups_lock:
+        group = active_groups.pop((session, widget), None)
+        if group is None:
+            return
+        cancelled_groups.add(group)
+    SparkContext.getOrCreate().cancelJobGroup(group)
+
+# run function(*args) as the update of widget for session, in the interactive
+# scheduler pool: the update still running for the same widget and session is
+# cancelled, and this one is cancelled after timeout seconds. A cancelled
+# update raises QueryCancelled
+
+def run_cancellable(session, widget, function, *args, timeout=query_timeout):
+    key = (session, widget)
+    group = f"{widget} {session} {next(group_ids)}"
+    # the previous update is marked cancelled while it's still registered, so
+    # its own cleanup drops the mark
+    with groups_lock:
+        previous = active_groups.get(key)
+        active_groups[key] = group
+        if previous is not None:
+            cancelled_groups.add(previous)
+    if previous is not None:
+        SparkContext.getOrCreate().cancelJobGroup(previous)
+    timer = threading.Timer(timeout, cancel_group, [group])
+    timer.daemon = True
+    timer.start()
+    try:
+        return in_pool(interactive_pool, in_group, group, function, *args)
+    except Exception as error:
+        with groups_lock:
+            cancelled = group in cancelled_groups
+        if cancelled and not isinstance(error, QueryCancelled):
+            raise QueryCancelled(group) from error
+        raise
+    finally:
+        timer.cancel()
+        with groups_lock:
+            if active_groups.get(key) == group:
+                del active_groups[key]
+            cancelled_groups.discard(group)
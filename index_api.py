@@ -0,0 +1,98 @@
+###### IMPORTS ########
+
+import numpy as np
+import pandas as pd
+
+###### FUNCTIONS ########
+
+# prefix sums over the days of the dataset (see spark_api.use_dates): row i+1 holds the totals from
+# the first day to the i-th one, so the totals of any range of days are the
+# difference of two rows.
+# daily is a pandas dataframe indexed by FlightDate with one column per metric
+# (days missing from daily count as zero)
+
+def build_prefix_sums(dates, daily):
+    dates = pd.DatetimeIndex(dates)
+    values = daily.reindex(dates).fillna(0).to_numpy(dtype="float64")
+    sums = np.zeros((len(dates) + 1, values.shape[1]))
+    np.cumsum(values, axis=0, out=sums[1:])
+    return {"dates": dates.values, "columns": daily.columns, "sums": sums}
+
+# first and last position (excluded) of the days between from_date and to_date
+
+def range_positions(index, from_date, to_date):
+    start = np.searchsorted(index["dates"], np.datetime64(pd.Timestamp(from_date)), side="left")
+    end = np.searchsorted(index["dates"], np.datetime64(pd.Timestamp(to_date)), side="right")
+    return start, max(start, end)
+
+# totals of every metric between from_date and to_date, both included
+
+def range_sum(index, from_date, to_date):
+    start, end = range_positions(index, from_date, to_date)
+    return pd.Series(index["sums"][end] - index["sums"][start], index=index["columns"])
+
+# counts of every value of column per (Year, Month, DayofMonth), with prefix
+# sums over the years, the months and the days: the counts of a window of
+# months and days of the month in a range of years are eight lookups per value.
+# daily is a pandas dataframe with the columns Year, Month, DayofMonth, column
+# and count
+
+def build_window_index(daily, column):
+    values = np.sort(daily[column].unique())
+    years = np.sort(daily["Year"].unique()).astype("int64")
+    counts = np.zeros((len(years) + 1, 13, 32, len(values)))
+    np.add.at(counts, (np.searchsorted(years, daily["Year"].to_numpy(dtype="int64")) + 1,
+                       daily["Month"].to_numpy(dtype="int64"), daily["DayofMonth"].to_numpy(dtype="int64"),
+                       pd.Index(values).get_indexer(daily[column])),
+              daily["count"].to_numpy(dtype="float64"))
+    sums = counts.cumsum(axis=0).cumsum(axis=1).cumsum(axis=2)
+    return {"values": values, "years": years, "sums": sums}
+
+# counts of every value in the months from start_month to end_month and the
+# days of the month from start_day to end_day of the years from start_year to
+# end_year (all of them if None), all included
+
+def window_sum(index, start_month, end_month, start_day, end_day, start_year=None, end_year=None):
+    years = index["years"]
+    first = 0 if start_year is None else np.searchsorted(years, start_year, side="left")
+    last = len(years) if end_year is None else np.searchsorted(years, end_year, side="right")
+    sums = index["sums"][max(first, last)] - index["sums"][first]
+    totals = sums[end_month, end_day] - sums[start_month - 1, end_day] - \
+                sums[end_month, start_day - 1] + sums[start_month - 1, start_day - 1]
+    return pd.Series(totals, index=index["values"])
+
+# the x values with the most (top) or the fewest flights in the window, in
+# order; the values without flights in the window are left out
+
+def top_values(index, x, start_month, end_month, start_day, end_day, top=True, start_year=None, end_year=None):
+    totals = window_sum(index, start_month, end_month, start_day, end_day, start_year, end_year)
+    totals = totals[totals > 0]
+    k = min(x, len(totals))
+    if k == 0:
+        return totals.iloc[0:0]
+    order = -totals.to_numpy() if top else totals.to_numpy()
+    chosen = np.argpartition(order, k - 1)[:k]
+    chosen = chosen[np.argsort(order[chosen], kind="stable")]
+    return totals.iloc[chosen]
+
+# route adjacency: for every origin the attributes of its routes (indexed by
+# Dest) and the prefix sums of their daily flights and arrival delays, so the
+# totals of the routes of an origin in any range of days are two lookups.
+# daily is a pandas dataframe with the columns Origin, Dest, FlightDate, count,
+# ArrDelay and the attributes of the routes
+
+def build_adjacency(dates, daily, attributes):
+    adjacency = {}
+    for origin, routes in daily.groupby("Origin"):
+        per_day = routes.groupby(["FlightDate", "Dest"])[["count", "ArrDelay"]].sum().unstack("Dest")
+        adjacency[origin] = {"routes": routes.groupby("Dest")[attributes].first(),
+                             "index": build_prefix_sums(dates, per_day)}
+    return adjacency
+
+# flights and sum of the arrival delays of every route of origin between
+# from_date and to_date, with the attributes of the routes
+
+def adjacent_totals(adjacency, origin, from_date, to_date):
+    entry = adjacency[origin]
+    totals = range_sum(entry["index"], from_date, to_date)
+    return entry["routes"].assign(count=totals["count"], ArrDelay=totals["ArrDelay"])
@@ -1,5 +1,7 @@
 ##### IMPORTS ######
 
+import base64
+import datetime
 import plotly.express as px
 import plotly.graph_objs as go
 import pandas as pd
@@ -7,122 +9,261 @@ import numpy as np
 from pyspark.sql.functions import *
 from plotly.subplots import make_subplots
 
-from spark_api import compute_flights_per_place, compute_flights_per_selected_place, compute_mean_arr_delay_per_dest, compute_mean_dep_delay_per_origin, compute_x_places_by_interval, get_column_aliases, get_column_per_agg_level, matrix_agg, origin_dest_query, reporting_airlines_queries, routes_queries, \
-                    scatter_queries, states_map_query, textual_queries
+from dimensions_api import labels
+from spark_api import cancellations_note, compute_flights_per_place, compute_flights_per_selected_place, compute_mean_arr_delay_per_dest, compute_mean_dep_delay_per_origin, delay_percentiles_per_period, fetch, get_column_aliases, get_column_per_agg_level, get_sample, matrix_agg, origin_dest_query, reporting_airlines_totals, routes_totals, \
+                    scatter_queries, states_map_query, textual_queries, x_places_totals
 
 
 ##### CONSTANTS ######
 
 week_days_names = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
 months_names = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
-states = pd.read_csv("util/states.csv",delimiter="\t",header=None)
-states.columns = ["State","unk","Abbreviation"]
-airports = pd.read_csv("util/airports.csv")
-airlines = pd.read_csv("util/airlines.csv")
-cancellations = pd.read_csv("util/cancellations.csv")
 
 column_aliases = get_column_aliases()
 column_per_aggregation_level = get_column_per_agg_level()
 
+# typed arrays understood by plotly.js (the 64 bit integers are sent as i4 or
+# f8), and the shortest array worth encoding
+binary_dtypes = {"int8": "i1", "uint8": "u1", "int16": "i2", "uint16": "u2", "int32": "i4", "uint32": "u4",
+                 "float32": "f4", "float64": "f8"}
+binary_min_length = 8
+# traces whose coordinates can be given as a start and a step (x0 and dx)
+evenly_spaced_traces = ["scatter", "scattergl", "bar"]
+
 ##### FUNCTIONS #######
 
+# approximate version of a plot, drawn on the stratified sample of the dataset
+# while the exact one is computed
+
+def preview_plot(plot, *args):
+    fig = plot(get_sample(), *args)
+    # the stores of the widgets drawn in the browser only carry the flag
+    if isinstance(fig, dict):
+        fig["preview"] = True
+        return fig
+    fig.add_annotation(text="Preview on a sample of the flights (with 95% error bounds), loading the exact result...",
+                       xref="paper", yref="paper", x=1, y=1.08, showarrow=False,
+                       font=dict(color="grey"))
+    return fig
+
+
+# the column with the 95% error bounds of column in an approximate result (see
+# sample_api.with_error_bounds), None in the exact ones
+
+def error_column(df, column):
+    error = column + "_error"
+    return error if error in df.columns else None
+
+# error bars on the traces of fig, whose x are values of the column x of df
+
+def error_bars(fig, df, x, y):
+    error = error_column(df, y)
+    if error is None:
+        return fig
+    bounds = df.drop_duplicates(x).set_index(x)[error]
+    fig.for_each_trace(lambda trace: trace.update(error_y=dict(type="data", array=bounds.reindex(trace.x).to_numpy())))
+    return fig
+
 
 # heatmap plot
 
 def matrix_plot(df,x,y,z="count"):
-    df_pd = matrix_agg(df,x,y,z).toPandas()
+    df_pd = fetch(matrix_agg,df,x,y,z)
+    matrix = df_pd.pivot(index=y, columns=x, values=f"{z}_agg")
 
+    # the labels follow the columns of the data (e.g. the years of the dataset)
     fig = px.imshow(
-        df_pd.pivot(y, x, f"{z}_agg"), 
+        matrix, 
         labels=dict(x=x, y=y, color=f"{z}_agg"),
         y=week_days_names,
-        x= months_names if x=="Month" else df_pd[x].unique().sort(),
+        x= [months_names[month - 1] for month in matrix.columns] if x=="Month" else [str(value) for value in matrix.columns],
     )
+    # the error bounds of the preview in the hover text
+    error = error_column(df_pd, f"{z}_agg")
+    if error is not None:
+        bounds = df_pd.pivot(index=y, columns=x, values=error).reindex(index=matrix.index, columns=matrix.columns)
+        fig.update_traces(customdata=bounds.to_numpy(),
+                          hovertemplate=f"{x}: %{{x}}<br>{y}: %{{y}}<br>{z}_agg: %{{z}} ± %{{customdata:.1f}}<extra></extra>")
     return fig
 
 # pie plot
 
 def origin_dest_plot(df,from_date,to_date,query="ArrDelay"):
-    df_pd = origin_dest_query(df,from_date,to_date,query).toPandas()
-    # complete with full name for states (e.g. CA -> California)
-    df_pd = df_pd.merge(states, left_on="ORIGIN_STATE", right_on="Abbreviation").\
-        rename(columns={"State": "Origin"}).\
-        merge(states, left_on="DEST_STATE", right_on="Abbreviation").\
-        rename(columns={"State": "Dest"})
-    # create a new column with origin and destination as a single element
-    df_pd["Origin-Dest"] = df_pd["Origin"] + " - " + df_pd["Dest"]
+    df_pd = fetch(origin_dest_query,df,from_date,to_date,query)
+    # create a new column with origin and destination as a single element,
+    # with the full names of the states (e.g. CA -> California)
+    df_pd["Origin-Dest"] = labels(df_pd["ORIGIN_STATE"], "states") + " - " + labels(df_pd["DEST_STATE"], "states")
     # create title based on query
     title = "Arrival delay by origin and destination" if query=="ArrDelay" else "Number of flights by origin and destination"
     title+=" from "+str(from_date.strftime("%d-%m-%Y"))+" to "+str(to_date.strftime("%d-%m-%Y"))
-    fig = px.pie(df_pd.head(20), values=query, names='Origin-Dest', title=title)
+    error = error_column(df_pd, query)
+    fig = px.pie(df_pd.head(20), values=query, names='Origin-Dest', title=title,
+                 hover_data=[error] if error is not None else None,
+                 labels={error: "± (95%)"} if error is not None else None)
     return fig
 
 
+# figure as a dict whose numeric data arrays are typed binary arrays
+# ({"dtype", "bdata"} in base64, decoded by plotly.js 2.28+), a fraction of
+# the size of the json lists of floats
+
+def binary_array(value):
+    array = np.asarray(value)
+    if array.ndim != 1 or len(array) < binary_min_length or array.dtype.kind not in "iuf":
+        return value
+    if array.dtype.kind in "iu" and array.dtype.itemsize == 8:
+        in_range = len(array) == 0 or (array.min() >= -2**31 and array.max() < 2**31)
+        array = array.astype("int32" if in_range else "float64")
+    dtype = binary_dtypes[array.dtype.name]
+    return {"dtype": dtype, "bdata": base64.b64encode(np.ascontiguousarray(array).tobytes()).decode("ascii")}
+
+def binary_values(value):
+    if isinstance(value, dict):
+        return {key: binary_values(item) for key, item in value.items()}
+    if isinstance(value, np.ndarray):
+        return binary_array(value)
+    if isinstance(value, (list, tuple)):
+        if len(value) >= binary_min_length and all(isinstance(item, (int, float, np.number)) and not isinstance(item, bool)
+                                                   for item in value):
+            return binary_array(value)
+        return [binary_values(item) for item in value]
+    return value
+
+# the dates on the x and y axes travel as milliseconds since the epoch, that
+# plotly.js reads as dates on the axes of type date; the evenly spaced ones
+# (e.g. the days of a time series) as their start and step only
+
+def date_milliseconds(value):
+    array = np.asarray(value)
+    if array.ndim != 1 or len(array) < binary_min_length:
+        return None
+    if array.dtype.kind != "M" and not (array.dtype.kind == "O" and
+                                        all(isinstance(item, datetime.date) for item in array)):
+        return None
+    dates = pd.DatetimeIndex(array)
+    if dates.tz is not None:
+        return None
+    return ((dates - pd.Timestamp(0)) / pd.Timedelta(milliseconds=1)).to_numpy(dtype="float64")
+
+def binary_figure(fig):
+    figure = fig.to_plotly_json()
+    layout = figure.setdefault("layout", {})
+    for trace in figure["data"]:
+        for axis in ["x", "y"]:
+            milliseconds = date_milliseconds(trace[axis]) if axis in trace else None
+            if milliseconds is not None:
+                steps = np.diff(milliseconds)
+                if trace.get("type", "scatter") in evenly_spaced_traces and len(steps) > 0 and \
+                        steps[0] > 0 and np.all(steps == steps[0]):
+                    del trace[axis]
+                    trace[axis + "0"], trace["d" + axis] = milliseconds[0], steps[0]
+                else:
+                    trace[axis] = milliseconds
+                name = axis + "axis" + trace.get(axis + "axis", axis)[1:]
+                layout.setdefault(name, {})["type"] = "date"
+    figure["data"] = [binary_values(trace) for trace in figure["data"]]
+    return figure
+
+# aggregate of a widget drawn in the browser (see assets/clientside.js), sent
+# once per query: the numeric columns as binary arrays, the others (e.g. the
+# dates) as lists of strings, with the parameters of the query
+
+def columnar_store(df_pd, **parameters):
+    columns = {}
+    for column in df_pd.columns:
+        values = df_pd[column]
+        if values.dtype.kind in "iuf":
+            encoded = binary_array(values.to_numpy())
+            columns[column] = encoded if isinstance(encoded, dict) else values.tolist()
+        else:
+            columns[column] = values.astype(str).tolist()
+    return dict(parameters, columns=columns, preview=False)
+
 # map routes plot
 
-def plot_routes(df,date_start,date_to,origin="BOS",query="NumFlights",scope="airports"):
-    df_aggregated=routes_queries(df,date_start,date_to,origin,query,scope).toPandas()
-    # complete IATA for airports with full name
+# points of the lines of the routes as two flat arrays (latitudes and
+# longitudes), the routes separated by NaN so that a single trace draws all of
+# them. With arc_points > 0 every line is the great circle between its ends,
+# sampled in arc_points intermediate points
+
+def route_lines(origin_lat, origin_lon, dest_lat, dest_lon, arc_points=0):
+    origin_lat, origin_lon = np.radians(origin_lat, dtype="float64"), np.radians(origin_lon, dtype="float64")
+    dest_lat, dest_lon = np.radians(dest_lat, dtype="float64"), np.radians(dest_lon, dtype="float64")
+    t = np.linspace(0, 1, arc_points + 2)
+    if arc_points > 0:
+        # spherical interpolation between the unit vectors of the two ends
+        start = np.stack([np.cos(origin_lat)*np.cos(origin_lon), np.cos(origin_lat)*np.sin(origin_lon), np.sin(origin_lat)], axis=-1)
+        end = np.stack([np.cos(dest_lat)*np.cos(dest_lon), np.cos(dest_lat)*np.sin(dest_lon), np.sin(dest_lat)], axis=-1)
+        omega = np.arccos(np.clip((start*end).sum(axis=-1), -1, 1))[:, None]
+        sin_omega = np.sin(omega)
+        close = sin_omega < 1e-9
+        sin_omega = np.where(close, 1, sin_omega)
+        a = np.where(close, 1 - t, np.sin((1 - t)*omega)/sin_omega)
+        b = np.where(close, t, np.sin(t*omega)/sin_omega)
+        points = a[..., None]*start[:, None, :] + b[..., None]*end[:, None, :]
+        lat = np.degrees(np.arctan2(points[..., 2], np.hypot(points[..., 0], points[..., 1])))
+        lon = np.degrees(np.arctan2(points[..., 1], points[..., 0]))
+    else:
+        lat = np.degrees(np.stack([origin_lat, dest_lat], axis=-1))
+        lon = np.degrees(np.stack([origin_lon, dest_lon], axis=-1))
+    separator = np.full((len(lat), 1), np.nan)
+    return np.hstack([lat, separator]).ravel(), np.hstack([lon, separator]).ravel()
+
+def plot_routes(df,date_start,date_to,origin="BOS",query="NumFlights",scope="airports",arc_points=0):
+    df_aggregated=routes_totals(df,date_start,date_to,origin,query,scope)
+    # name of the destination: IATA of the airports or abbreviation of the
+    # states to full name
     if scope == "airports":
-        df_aggregated = df_aggregated.merge(airports, left_on="Origin", right_on="IATA")
-        df_aggregated = df_aggregated.merge(airports, left_on="Dest", right_on="IATA")
-    # states abbreviation to full name
+        df_aggregated["DEST_NAME"] = labels(df_aggregated["Dest"], "airports")
     else:
-        df_aggregated = df_aggregated.merge(states, left_on="ORIGIN_STATE", right_on="Abbreviation")
-        df_aggregated = df_aggregated.merge(states, left_on="DEST_STATE", right_on="Abbreviation")
-        
-    
+        df_aggregated["DEST_NAME"] = labels(df_aggregated["DEST_STATE"], "states")
+
+    return routes_figure(df_aggregated,query,scope,arc_points)
+
+# the map of the routes of df_aggregated (the routes with the names of their
+# destinations in DEST_NAME): one trace with the lines of all the routes and one with the markers
+# of the destinations
+
+def routes_figure(df_aggregated,query="NumFlights",scope="airports",arc_points=0):
     fig = go.Figure()
-    
-    # create tuple with latitudes of source and destination and query type
-    source_to_dest = zip(df_aggregated["ORIGIN_LATITUDE"], df_aggregated["DEST_LATITUDE"],
-                         df_aggregated["ORIGIN_LONGITUDE"], df_aggregated["DEST_LONGITUDE"],
-                         df_aggregated[query])
-
-    # loop thorugh each flight entry to add line between source and destination
-    for slat,dlat, slon, dlon, num_flights in source_to_dest:
-        fig.add_trace(go.Scattergeo(
-                            lat = [slat,dlat],
-                            lon = [slon, dlon],
-                            mode = 'lines',
-                            line = dict(width = 1, color="red"),
-                            # disable hover info
-                            hoverinfo="skip",
-                            textposition="top center"
-                    ))
-
-    # Logic to create labels of source and destination cities of flights
-    if scope=="airports":
-        cities = df_aggregated["AIRPORT_x"].values.tolist()+df_aggregated["AIRPORT_y"].values.tolist()
-    else:
-        cities = df_aggregated["State_x"].values.tolist()+df_aggregated["State_y"].values.tolist()
 
-    #scatter_hover_data = [city for city in cities]
+    # lines between source and destination of every route, in a single trace
+    lat, lon = route_lines(df_aggregated["ORIGIN_LATITUDE"].to_numpy(), df_aggregated["ORIGIN_LONGITUDE"].to_numpy(),
+                           df_aggregated["DEST_LATITUDE"].to_numpy(), df_aggregated["DEST_LONGITUDE"].to_numpy(),
+                           arc_points)
+    fig.add_trace(go.Scattergeo(
+                        lat = lat,
+                        lon = lon,
+                        mode = 'lines',
+                        line = dict(width = 1, color="red"),
+                        # disable hover info
+                        hoverinfo="skip",
+                ))
 
     if query == "AverageArrivalDelay":
         df_aggregated[query] = df_aggregated[query] + df_aggregated[query].min()*-1
 
-    # create a column as concatenation of AIRPORT_x and query
-    target_col = "AIRPORT_y" if scope=="airports" else "State_y"
-
-    # create the text to show when hovering with mouse
-    df_aggregated[target_col] = df_aggregated[target_col] + "<br>"+query+" : "+ df_aggregated[query].astype(str)
-    text = df_aggregated[target_col].values.tolist()
+    # create the text to show when hovering with mouse, with the error bounds
+    # of the previews
+    text = df_aggregated["DEST_NAME"] + "<br>"+query+" : "+ df_aggregated[query].astype(str)
+    error = error_column(df_aggregated, query)
+    if error is not None:
+        text = text + " ± " + df_aggregated[error].round(1).astype(str)
+    text = text.to_numpy()
 
     # define the size of the marker based on value of query
-    df_aggregated[query]=df_aggregated[query]/df_aggregated[query].max()
     # subsitute the nan values with 0 if any
-    df_aggregated[query] = df_aggregated[query].fillna(0)
+    size = (df_aggregated[query]/df_aggregated[query].max()).fillna(0).to_numpy()
     
-    # Loop thorugh each flight entry to plot source and destination as points.
+    # source and destination as points
     fig.add_trace(
         go.Scattergeo(
-                    lon = df_aggregated["DEST_LONGITUDE"].values.tolist(),
-                    lat = df_aggregated["DEST_LATITUDE"].values.tolist(),
+                    lon = df_aggregated["DEST_LONGITUDE"].to_numpy(),
+                    lat = df_aggregated["DEST_LATITUDE"].to_numpy(),
                     hoverinfo = 'text',
                     text = text,
                     mode = 'markers',
-                    marker = dict(size = df_aggregated[query]*20+1, color = 'blue', opacity=0.9))
+                    marker = dict(size = size*20+1, color = 'blue', opacity=0.9))
         )
 
     # Update graph layout to improve graph styling.
@@ -152,39 +293,30 @@ def plot_routes(df,date_start,date_to,origin="BOS",query="NumFlights",scope="air
 
     return fig
 
-# map states plot
+# map states plot: the flights and the average delay of every state, the
+# browser draws the map of the selected one
 
-def plot_states_map(df,group,query):
-    df_avg = states_map_query(df,group).toPandas()
+def states_store(df,group):
+    df_avg = fetch(states_map_query,df,group)
 
     # remove AS and GU as they are not in the map. They don't appear in the map
     df_avg = df_avg.drop(df_avg[df_avg[group] == "AS"].index)
     df_avg = df_avg.drop(df_avg[df_avg[group] == "GU"].index)
     
-    # join with states for abbreviation conversion
-    df_avg = df_avg.merge(states, left_on=group, right_on="Abbreviation")
-
-    fig = px.choropleth(df_avg,locations=group, 
-                        locationmode="USA-states", 
-                        color=query, scope="usa",
-                        hover_data=["State"])
+    # abbreviation to full name
+    df_avg["State"] = labels(df_avg[group], "states")
 
-    title = "Average arrival delay " if query=="ArrDelay" else "Number of flights "
-    title+="by origin state " if group=="ORIGIN_STATE" else "by destination state "
-    fig.update_layout(title_text=title)
-    
-    return fig
+    # the error bounds of the previews are drawn in the hover text
+    columns = [group,"State","count","ArrDelay"]
+    columns += [error_column(df_avg, column) for column in ["count","ArrDelay"] if error_column(df_avg, column) is not None]
+    return columnar_store(df_avg[columns], group=group)
 
 
 # airline plot
 
 def plot_reporting_airlines(df,from_date,to_date,query="count"):
-    if query == "Cancelled":
-        df_agg = cancellations.merge(airlines,left_on="Reporting_Airline",right_on="IATA")
-        df_agg = df_agg.sort_values(by="Cancelled",ascending=False)
-    else:
-        df_agg = reporting_airlines_queries(df,from_date,to_date,query).toPandas()
-        df_agg = df_agg.merge(airlines, left_on="Reporting_Airline", right_on="IATA")
+    df_agg = reporting_airlines_totals(df,from_date,to_date,query)
+    df_agg["Name"] = labels(df_agg["Reporting_Airline"], "airlines")
 
     if query=="count":
         title = "Number of flights by reporting airline"
@@ -192,6 +324,8 @@ def plot_reporting_airlines(df,from_date,to_date,query="count"):
         title = "Average arrival delay by reporting airline"
     else:
         title = "Number of cancelled flights by reporting airline"
+        if cancellations_note(from_date,to_date):
+            title += " (" + cancellations_note(from_date,to_date) + ")"
     if query == "avg":
         y = "ArrDelay"
     elif query == "count":
@@ -199,27 +333,19 @@ def plot_reporting_airlines(df,from_date,to_date,query="count"):
     else:
         y = "Cancelled"
     
-    fig = px.bar(df_agg, x="Name", y=y, color="Name")
+    fig = px.bar(df_agg, x="Name", y=y, color="Name", error_y=error_column(df_agg, y))
     fig.update_layout(title_text=title)
 
     return fig
 
-# scatter plot
-
-def plot_scatter(df,temp_granularity,x,y,z):
-    df_pd = scatter_queries(df,temp_granularity).toPandas()
-    fig = px.scatter(df_pd, x=x, y=y,color=z,hover_data=[temp_granularity])
-    dict = {"ArrDelay" : " the average arrival delay ", 
-            "DepDelay" : " the average departure delay ",
-            "count" : " the number of flights ",
-            "TaxiIn" : " the average taxi in time ",
-            "TaxiOut" : " the average taxi out time ",
-            "AirTime" : " the average air time ",
-            "distance" : " the average distance "
-    }
-    title = f"Scatter plot with {dict[x]} on the x-axis, {dict[y]} on the y-axis and {dict[z]} as the colormap."
-    fig.update_layout(title_text=title)
-    return fig
+# scatter plot: all the measures of every period, the browser draws the
+# selected axes and colors
+
+def scatter_store(df,temp_granularity):
+    df_pd = fetch(scatter_queries,df,temp_granularity)
+    # the periods are only shown in the hover text
+    df_pd = df_pd.astype({temp_granularity: str})
+    return columnar_store(df_pd, granularity=temp_granularity)
 
 # textual "plot", it makes a simple redirection to the textual_queries function from
 # spark api
@@ -228,73 +354,98 @@ def plot_textual(df,date_from, date_to):
     return textual_queries(df,date_from,date_to)
 
 
-def plot_x_places_by_interval(flights_df, x, start_month, end_month, start_day, end_day, place_attribute, sort_by):
-    places = compute_x_places_by_interval(flights_df, x, start_month, end_month, start_day, end_day, place_attribute, sort_by)
+def plot_x_places_by_interval(flights_df, x, start_month, end_month, start_day, end_day, place_attribute, sort_by, start_year=None, end_year=None):
+    places = x_places_totals(flights_df, x, start_month, end_month, start_day, end_day, place_attribute, sort_by, start_year, end_year)
     place_column_alias = column_aliases[place_attribute]
     title = str(sort_by) + " " + str(x) + " " + place_column_alias
-    x_places_hist_plot = px.histogram(places.toPandas(), x=place_attribute, y="Count", color=px.colors.qualitative.Vivid[0:x], title=title,
+    x_places_hist_plot = px.histogram(places, x=place_attribute, y="Count", color=px.colors.qualitative.Vivid[0:x], title=title,
                                    labels = {
                                             place_attribute: place_column_alias,
                                             "sum of Count": "Count"})
     x_places_hist_plot.update_layout(showlegend=False) 
-    return x_places_hist_plot
+    return error_bars(x_places_hist_plot, places, place_attribute, "Count")
 
-def pie_plot_by_interval(flights_df, x, start_month, end_month, start_day, end_day, place_attribute, sort_by):
-    places = compute_x_places_by_interval(flights_df, x, start_month, end_month, start_day, end_day, place_attribute, sort_by)
+def pie_plot_by_interval(flights_df, x, start_month, end_month, start_day, end_day, place_attribute, sort_by, start_year=None, end_year=None):
+    places = x_places_totals(flights_df, x, start_month, end_month, start_day, end_day, place_attribute, sort_by, start_year, end_year)
     place_column_alias = column_aliases[place_attribute]
     title = sort_by + " " + str(x) + " " + place_column_alias 
-    flights_pie_plot = px.pie(places.toPandas(), values='Count', names=place_attribute, title=title,
-                              labels = { 
-                                        place_attribute: place_column_alias,
-                                        "sum of Count": "Count"})
+    error = error_column(places, "Count")
+    pie_labels = {place_attribute: place_column_alias, "sum of Count": "Count"}
+    if error is not None:
+        pie_labels[error] = "± (95%)"
+    flights_pie_plot = px.pie(places, values='Count', names=place_attribute, title=title,
+                              hover_data=[error] if error is not None else None,
+                              labels = pie_labels)
     return flights_pie_plot
 
-# si possono eseguirei in parallelo le prime due query 
-def facet_plot_over_interval(flights_df, x, start_month, end_month, start_day, end_day, place_attribute, sort_by):
-    places = compute_x_places_by_interval(flights_df, x, start_month, end_month, start_day, end_day, place_attribute, sort_by)
-    places = np.array(places.select(place_attribute).collect()).reshape(-1)
-    flights_per_place  = compute_flights_per_place(flights_df, start_month, end_month, start_day, end_day, place_attribute)
-    fig = make_subplots(rows=x, cols=1) 
-    flights_per_place = flights_per_place.toPandas()
-    for i in range(len(places)):
-        place = places[i]
-        flights_per_place_i_pd = flights_per_place[flights_per_place[place_attribute] == place]
-        place_column_alias = column_aliases[place_attribute]
+# the daily flights of the top (or bottom) x places, one subplot each: only the
+# series of those places are queried, and split with a single groupby
+
+def facet_plot_over_interval(flights_df, x, start_month, end_month, start_day, end_day, place_attribute, sort_by, start_year=None, end_year=None):
+    places = x_places_totals(flights_df, x, start_month, end_month, start_day, end_day, place_attribute, sort_by, start_year, end_year)
+    places = list(places[place_attribute])
+    flights_per_place = fetch(compute_flights_per_place, flights_df, places, start_month, end_month, start_day, end_day, place_attribute, start_year, end_year)
+    series = dict(tuple(flights_per_place.groupby(place_attribute, sort=False)))
+    place_column_alias = column_aliases[place_attribute]
 
+    fig = make_subplots(rows=max(len(places), 1), cols=1)
+    for i, place in enumerate(places):
+        flights_per_place_i_pd = series.get(place, flights_per_place.iloc[0:0])
+        error = error_column(flights_per_place_i_pd, 'count')
         fig.add_trace(
             go.Scatter(x=flights_per_place_i_pd['FlightDate'], y=flights_per_place_i_pd['count'], 
-                        name=place),
+                        name=place,
+                        error_y=dict(type="data", array=flights_per_place_i_pd[error]) if error is not None else None),
             row=i+1, col=1
         )
         
     title = sort_by + " " + str(x) + " "  + place_column_alias 
-    fig.update_layout(height=1100, width=1200, title_text=title)
+    # 110 pixels for every subplot, as with the first 10
+    fig.update_layout(height=max(1100, 110*len(places)), width=1200, title_text=title)
     return fig
 
 
-def plot_mean_arr_delay_per_dest(flights_df, destinations, dest_attribute, aggregation_level):
-    mean_arr_delay_per_dest = compute_mean_arr_delay_per_dest(flights_df, destinations, dest_attribute, aggregation_level)
+# statistic is "mean" or a percentile of the delays ("p50", "p90", "p99"),
+# read from the delay sketches
+
+def plot_mean_arr_delay_per_dest(flights_df, destinations, dest_attribute, aggregation_level, statistic="mean"):
     period = column_per_aggregation_level[aggregation_level]
-    y = "avg(" + "ArrDelayMinutes" + ")"
+    if statistic == "mean":
+        mean_arr_delay_per_dest = fetch(compute_mean_arr_delay_per_dest, flights_df, destinations, dest_attribute, aggregation_level)
+        y = "avg(" + "ArrDelayMinutes" + ")"
+        y_label = "Average arrival delay (Minutes)"
+    else:
+        mean_arr_delay_per_dest = delay_percentiles_per_period(flights_df, destinations, dest_attribute, "ArrDelayMinutes", aggregation_level)
+        y = statistic
+        y_label = statistic + " arrival delay (Minutes)"
     dest_column_alias = column_aliases[dest_attribute]
-    mean_arr_delay_plot = px.line(mean_arr_delay_per_dest.toPandas(), x=period, y=y, color=dest_attribute,
+    mean_arr_delay_plot = px.line(mean_arr_delay_per_dest, x=period, y=y, color=dest_attribute,
+                                        error_y=error_column(mean_arr_delay_per_dest, y),
                                         labels = {dest_attribute: dest_column_alias,
-                                                  "avg(ArrDelayMinutes)": "Average arrival delay (Minutes)"})
+                                                  y: y_label})
     return mean_arr_delay_plot
 
 
-def plot_mean_dep_delay_per_origin(flights_df, origins, origin_attribute, aggregation_level):
-    mean_dep_delay_per_origin = compute_mean_dep_delay_per_origin(flights_df, origins, origin_attribute, aggregation_level)
+def plot_mean_dep_delay_per_origin(flights_df, origins, origin_attribute, aggregation_level, statistic="mean"):
     period = column_per_aggregation_level[aggregation_level]
-    y = "avg(" + "DepDelayMinutes" + ")"
+    if statistic == "mean":
+        mean_dep_delay_per_origin = fetch(compute_mean_dep_delay_per_origin, flights_df, origins, origin_attribute, aggregation_level)
+        y = "avg(" + "DepDelayMinutes" + ")"
+        y_label = "Average departure delay (Minutes)"
+    else:
+        mean_dep_delay_per_origin = delay_percentiles_per_period(flights_df, origins, origin_attribute, "DepDelayMinutes", aggregation_level)
+        y = statistic
+        y_label = statistic + " departure delay (Minutes)"
     origin_column_alias = column_aliases[origin_attribute]
-    mean_dep_delay_plot = px.line(mean_dep_delay_per_origin.toPandas(), x=period, y=y, color=origin_attribute,
+    mean_dep_delay_plot = px.line(mean_dep_delay_per_origin, x=period, y=y, color=origin_attribute,
+                                        error_y=error_column(mean_dep_delay_per_origin, y),
                                         labels = {origin_attribute: origin_column_alias,
-                                                  "avg(DepDelayMinutes)": "Average departure delay (Minutes)"})
+                                                  y: y_label})
     return mean_dep_delay_plot
 
 def plot_num_of_flights_facet(flights_df, place, place_column):
-    num_of_flights_per_selected_place = compute_flights_per_selected_place(flights_df, place_column, place)
-    num_of_flights_facet_plot = px.line(num_of_flights_per_selected_place.toPandas(), x="FlightDate", y="count", 
+    num_of_flights_per_selected_place = fetch(compute_flights_per_selected_place, flights_df, place_column, place)
+    num_of_flights_facet_plot = px.line(num_of_flights_per_selected_place, x="FlightDate", y="count",
+                                        error_y=error_column(num_of_flights_per_selected_place, "count"),
                                         labels = {"count": "Count"})
     return num_of_flights_facet_plot
\ No newline at end of file
@@ -0,0 +1,168 @@
+###### IMPORTS ########
+
+import threading
+from collections import namedtuple
+import pyspark.sql.functions as F
+
+from cube_api import avg_measure, count_measure, get_source, project, sum_measure
+from storage_api import files_matching, read_files, skipping_report
+
+###### CONSTANTS ########
+
+# declarative query: group by keys and compute measures over the rows that
+# pass the filters, sorted by order and cut at limit.
+# - measures are (alias, kind, column), kind being "count", "sum", "avg" or a
+#   percentile "p50", "p90", ...
+# - filters are (operator, column, parameters...): ("eq", column, name),
+#   ("isin", column, name), ("between", column, low, high) and
+#   ("date_range", "FlightDate", from, to), where the names are parameters
+#   bound when the query runs
+# - order is a list of (column, ascending), limit a number or a parameter
+# The specs are hashable: their plans are compiled once per spec and dataset
+QuerySpec = namedtuple("QuerySpec", ["keys", "measures", "filters", "order", "limit"])
+
+# (spec, id of the dataset) -> (dataset, projected source, from_cube, aggregations)
+compiled_plans = {}
+plans_lock = threading.Lock()
+
+# the dataset read from the clustered parquet, with its path and the min/max
+# statistics of its files (see storage_api.write_parquet)
+layout = None
+
+# spec -> files and bytes skipped by its runs on the clustered dataset
+skipping = {}
+
+###### FUNCTIONS ########
+
+def query_spec(keys, measures, filters=(), order=(), limit=None):
+    return QuerySpec(tuple(keys), tuple(tuple(measure) for measure in measures),
+                     tuple(tuple(condition) for condition in filters),
+                     tuple(tuple(item) for item in order), limit)
+
+def is_percentile(kind):
+    return kind.startswith("p") and kind[1:].isdigit()
+
+def measure_column(alias, kind, column, from_cube):
+    if kind == "count":
+        return count_measure(from_cube, alias)
+    if kind == "sum":
+        return sum_measure(column, from_cube, alias)
+    if kind == "avg":
+        return avg_measure(column, from_cube, alias)
+    if is_percentile(kind):
+        return F.percentile_approx(column, int(kind[1:]) / 100).alias(alias)
+    raise ValueError("unknown measure: " + str(kind))
+
+# the columns a spec reads; the date range filter also reads the partition
+# columns (see filter_date_range)
+
+def spec_columns(spec):
+    columns = list(spec.keys)
+    for condition in spec.filters:
+        columns += ["Year", "Month", condition[1]] if condition[0] == "date_range" else [condition[1]]
+    columns += [column for _, _, column in spec.measures if column is not None]
+    return list(dict.fromkeys(columns))
+
+# filter on the date range. The bounds on Year and Month only involve the
+# partition columns, so with the parquet storage Spark skips the partitions
+# outside the period; on the csv they are just a redundant condition
+
+def filter_date_range(df, from_date, to_date):
+    first_month = from_date.year*100 + from_date.month
+    last_month = to_date.year*100 + to_date.month
+    df = df.filter((df["Year"]*100 + df["Month"]).between(first_month, last_month))
+    df = df.filter(df["FlightDate"].between(from_date, to_date))
+    return df
+
+# the plan of spec on df: the source chosen by get_source (the cube or the
+# sample when they can answer, df otherwise; percentiles need the flights)
+# with only the needed columns, and the aggregations. Its analysis is done once
+
+def compile_spec(spec, df):
+    key = (spec, id(df))
+    with plans_lock:
+        plan = compiled_plans.get(key)
+    if plan is not None and plan[0] is df:
+        return plan
+    columns = spec_columns(spec)
+    if any(is_percentile(kind) for _, kind, _ in spec.measures):
+        source, from_cube = df, False
+    else:
+        source, from_cube = get_source(df, columns)
+    source = project(source, columns, from_cube)
+    aggregations = [measure_column(alias, kind, column, from_cube) for alias, kind, column in spec.measures]
+    plan = (df, source, from_cube, aggregations)
+    with plans_lock:
+        compiled_plans[key] = plan
+    return plan
+
+def register_layout(df, path, stats):
+    global layout
+    layout = (df, path, stats) if stats is not None else None
+
+# the (low, high) intervals of the filtered columns with the parameters params
+
+def spec_bounds(spec, params):
+    bounds = {}
+    for condition in spec.filters:
+        operator, column = condition[0], condition[1]
+        values = [params[name] for name in condition[2:]]
+        if operator == "eq":
+            bounds[column] = [(values[0], values[0])]
+        elif operator == "isin":
+            bounds[column] = [(value, value) for value in values[0]]
+        else:
+            bounds[column] = [(values[0], values[1])]
+    return bounds
+
+# the flights of the files of the clustered dataset that can contain rows of
+# the spec, None if the spec doesn't run on it or can't skip any file
+
+def skip_files(spec, df, columns, params):
+    if layout is None or layout[0] is not df or not spec.filters:
+        return None
+    _, path, stats = layout
+    keep = files_matching(stats, spec_bounds(spec, params))
+    report = skipping_report(stats, keep)
+    with plans_lock:
+        totals = skipping.setdefault(spec, {"runs": 0, "files": 0, "skipped_files": 0, "bytes": 0, "skipped_bytes": 0})
+        totals["runs"] += 1
+        for name, value in report.items():
+            totals[name] += value
+    if keep.all():
+        return None
+    return project(read_files(df.sparkSession, list(stats.loc[keep, "file"]), path), columns, False)
+
+def skipping_stats():
+    with plans_lock:
+        return {spec: dict(totals) for spec, totals in skipping.items()}
+
+def bind_filter(source, condition, params):
+    operator, column = condition[0], condition[1]
+    values = [params[name] for name in condition[2:]]
+    if operator == "eq":
+        return source.filter(F.col(column) == values[0])
+    if operator == "isin":
+        return source.filter(F.col(column).isin(values[0]))
+    if operator == "between":
+        return source.filter(F.col(column).between(values[0], values[1]))
+    if operator == "date_range":
+        return filter_date_range(source, values[0], values[1])
+    raise ValueError("unknown filter: " + str(operator))
+
+# the spark dataframe of spec on df with the parameters params
+
+def run_spec(spec, df, **params):
+    _, source, from_cube, aggregations = compile_spec(spec, df)
+    skipped = skip_files(spec, df, spec_columns(spec), params) if not from_cube else None
+    if skipped is not None:
+        source = skipped
+    for condition in spec.filters:
+        source = bind_filter(source, condition, params)
+    result = source.groupBy(*spec.keys).agg(*aggregations)
+    if spec.order:
+        result = result.orderBy(*[F.col(column).asc() if ascending else F.col(column).desc()
+                                  for column, ascending in spec.order])
+    if spec.limit is not None:
+        result = result.limit(params[spec.limit] if isinstance(spec.limit, str) else spec.limit)
+    return result
@@ -0,0 +1,104 @@
+###### IMPORTS ########
+
+import os
+import numpy as np
+import pyspark.sql.functions as F
+
+from cube_api import cube_measures
+
+###### CONSTANTS ########
+
+sample_path = "data.nosync/cleaned/flights_sample.parquet"
+
+# every (Origin, Year, Month) is sampled at sample_rate, but with at least
+# min_stratum_rows flights (all of them for the smaller strata), so the small
+# airports are still in the approximate results of every year
+strata = ["Origin", "Year", "Month"]
+sample_rate = 0.02
+min_stratum_rows = 200
+seed = 42
+
+# normal quantile of the 95% error bounds
+confidence_z = 1.96
+
+# names of the count columns in the query results
+count_columns = ["count", "Count", "NumFlights", "count_agg"]
+
+# standard deviation of every measure, measured on the sample
+deviations = {}
+
+###### FUNCTIONS ########
+
+# stratified sample of df with the layout of the cube (see cube_api.py): every
+# sampled flight is a row whose count is its weight (the inverse of the
+# sampling fraction of its stratum) and whose measures are weighted in the same
+# way, so the queries on the sample estimate the counts and sums of df and the
+# averages are weighted averages
+
+def build_sample(df, rate=sample_rate, min_rows=min_stratum_rows):
+    sizes = df.groupBy(*strata).agg(F.count(F.lit(1)).alias("stratum_rows"))
+    fraction = F.least(F.lit(1.0), F.greatest(F.lit(rate), F.lit(min_rows) / F.col("stratum_rows")))
+    sampled = df.join(F.broadcast(sizes), strata).\
+                withColumn("fraction", fraction).\
+                filter(F.rand(seed) < F.col("fraction"))
+    columns = [column for column in df.columns if column not in cube_measures]
+    return sampled.select(*columns,
+                          (1 / F.col("fraction")).alias("count"),
+                          *[(F.col(m) / F.col("fraction")).alias(m + "_sum") for m in cube_measures])
+
+def save_sample(sample_df, path=sample_path):
+    sample_df.write.mode("overwrite").partitionBy("Year", "Month").parquet(path)
+
+# read the materialized sample if it exists, otherwise draw it from df; it is
+# kept in memory, so the sampling is done once
+
+def load_sample(spark, df, path=sample_path):
+    if os.path.isdir(path):
+        sample_df = spark.read.parquet(path)
+    else:
+        sample_df = build_sample(df)
+    return sample_df.cache()
+
+def measure_deviations(sample_df):
+    row = sample_df.agg(*[F.stddev(F.col(m + "_sum") / F.col("count")).alias(m) for m in cube_measures]).\
+                    collect()[0]
+    return {m: row[m] for m in cube_measures if row[m] is not None}
+
+# the measure behind a column of a query result (e.g. avg(ArrDelayMinutes))
+
+def measure_of(column):
+    if column == "AverageArrivalDelay":
+        return "ArrDelay"
+    for measure in cube_measures:
+        if column in (measure, f"avg({measure})", f"{measure}_agg"):
+            return measure
+    return None
+
+# 95% error bounds of an approximate result, as a <column>_error column next
+# to every estimate. A count N estimated from weights of at most w has
+# variance at most (w-1)*N; an average has variance about (w-1)*s^2/N, with s
+# the deviation of its measure, so it is bounded only if the result has the
+# counts of its groups
+
+def with_error_bounds(result, rate=sample_rate):
+    max_weight = 1 / rate
+    counts = [column for column in count_columns if column in result.columns]
+    for column in counts:
+        result[column + "_error"] = confidence_z * np.sqrt((max_weight - 1) * result[column])
+    if counts:
+        flights = result[counts[0]]
+        for column in result.columns:
+            measure = measure_of(column)
+            if measure in deviations:
+                result[column + "_error"] = confidence_z * deviations[measure] * np.sqrt((max_weight - 1) / flights)
+    return result
+
+
+##### SAMPLE MATERIALIZATION #######
+
+# python sample_api.py
+if __name__ == "__main__":
+    from spark_api import load_dataset
+
+    save_sample(build_sample(load_dataset()))
+    print("written", sample_path)
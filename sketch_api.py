@@ -0,0 +1,172 @@
+###### IMPORTS ########
+
+import math
+import os
+import numpy as np
+import pandas as pd
+import pyspark.sql.functions as F
+
+from executor_api import background_pool, run_parallel
+
+###### CONSTANTS ########
+
+# directory of the materialized sketches, one parquet file per place and measure
+sketches_path = "data.nosync/cleaned/delay_sketches"
+
+# the delays of every (day, place) are summarized by a histogram on
+# logarithmic buckets: bucket i holds the delays in (gamma^(i-1), gamma^i], and
+# bucket -1 the flights without delay. Any quantile read from the histogram is
+# within relative_accuracy of the exact one, and two histograms are merged by
+# summing their counts
+relative_accuracy = 0.01
+gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+
+sketch_measures = ["ArrDelayMinutes", "DepDelayMinutes"]
+
+# places with a sketch, with the columns that depend only on them (their state)
+sketch_places = {"origin": ["ORIGIN_AIRPORT_FULL_NAME", "ORIGIN_STATE_FULL_NAME"],
+                 "dest": ["DEST_AIRPORT_FULL_NAME", "DEST_STATE_FULL_NAME"],
+                 "airline": ["Reporting_Airline"]}
+
+# the sketches are kept per day: the other periods of the line charts depend
+# only on the day, and are computed from it when a chart is drawn (see
+# period_of)
+sketch_periods = ["FlightDate"]
+
+percentiles = [50, 90, 99]
+
+###### FUNCTIONS ########
+
+def bucket_column(measure):
+    return measure + "_bucket"
+
+# spark expression of the bucket of a delay
+
+def bucket_of(measure):
+    return F.when(F.col(measure) < 1, F.lit(-1)).\
+                otherwise(F.ceil(F.log(F.col(measure)) / math.log(gamma))).\
+                cast("int")
+
+# delay represented by every bucket, with relative error at most
+# relative_accuracy for the delays in it
+
+def bucket_values(buckets):
+    buckets = np.asarray(buckets, dtype="float64")
+    return np.where(buckets < 0, 0.0, 2 * gamma ** buckets / (gamma + 1))
+
+# the flights with the bucket of every measure, the source of the sketches
+# (the cleaned dataset has the delays of every flight)
+
+def with_buckets(df):
+    df = df.filter(F.col(sketch_measures[0]).isNotNull() & F.col(sketch_measures[1]).isNotNull())
+    return df.select(*sketch_periods,
+                     *[column for columns in sketch_places.values() for column in columns],
+                     *[bucket_of(measure).alias(bucket_column(measure)) for measure in sketch_measures])
+
+# the sketches of every place and measure: one row per (day, place, bucket)
+# with its number of flights, as a pandas dataframe. bucketed is with_buckets
+# of the flights; the strings are stored as categories and the numbers with
+# the smallest types that hold them, to save memory
+
+def build_sketch(bucketed, place, measure):
+    keys = sketch_periods + sketch_places[place] + [bucket_column(measure)]
+    frame = bucketed.groupBy(*keys).agg(F.count(F.lit(1)).alias("count")).toPandas()
+    frame = frame.rename(columns={bucket_column(measure): "bucket"})
+    frame["FlightDate"] = pd.to_datetime(frame["FlightDate"])
+    frame = frame.astype({"bucket": "int16", "count": "int32"})
+    for column in frame.columns:
+        if frame[column].dtype == object:
+            frame[column] = frame[column].astype("category")
+    return frame.reset_index(drop=True)
+
+# the sketches of every place and measure of df, (place, measure) -> sketch:
+# one small query each over the cached buckets of the delays, run side by side
+
+def build_sketches(df):
+    bucketed = with_buckets(df).cache()
+    keys = [(place, measure) for place in sketch_places for measure in sketch_measures]
+    try:
+        frames = run_parallel([(build_sketch, (bucketed, place, measure)) for place, measure in keys],
+                                pool=background_pool)
+    finally:
+        bucketed.unpersist()
+    return dict(zip(keys, frames))
+
+def sketch_file(place, measure, path=sketches_path):
+    return os.path.join(path, f"{place}_{measure}.parquet")
+
+def save_sketches(sketches, path=sketches_path):
+    os.makedirs(path, exist_ok=True)
+    for (place, measure), sketch in sketches.items():
+        sketch.to_parquet(sketch_file(place, measure, path), index=False)
+
+# the materialized sketches, None if they haven't been written
+# (python sketch_api.py)
+
+def load_sketches(path=sketches_path):
+    files = {(place, measure): sketch_file(place, measure, path)
+                for place in sketch_places for measure in sketch_measures}
+    if not all(os.path.exists(file) for file in files.values()):
+        return None
+    return {key: pd.read_parquet(file) for key, file in files.items()}
+
+# a period of the line charts (FlightDate, WeekofMonth, Month or Year) of the
+# days: WeekofMonth is the date in the year and month of the day whose day of
+# the month is the week of the month (the weeks start on Sunday), as in the
+# preprocessing of the dataset
+
+def period_of(days, period):
+    days = pd.to_datetime(pd.Series(days))
+    if period == "FlightDate":
+        return days
+    if period == "Month":
+        return days.dt.month
+    if period == "Year":
+        return days.dt.year
+    first_weekday = (days.dt.dayofweek - (days.dt.day - 1) + 1) % 7
+    week = (days.dt.day - 1 + first_weekday) // 7 + 1
+    return pd.to_datetime(pd.DataFrame({"year": days.dt.year, "month": days.dt.month, "day": week}))
+
+# the sketch with the column period, computed once per day
+
+def with_period(sketch, period):
+    if period == "FlightDate":
+        return sketch
+    days = sketch["FlightDate"].unique()
+    periods = pd.Series(period_of(days, period).to_numpy(), index=days)
+    return sketch.assign(**{period: sketch["FlightDate"].map(periods)})
+
+# the place of the sketches with the place column (e.g. ORIGIN_STATE_FULL_NAME)
+
+def sketch_place(place_column):
+    for place, columns in sketch_places.items():
+        if place_column in columns:
+            return place
+    return None
+
+# percentiles of the merged sketches of every group of keys, in the columns
+# p50, p90, ...: the value of the first bucket whose cumulative count reaches
+# the percentile of the flights of the group
+
+def merged_percentiles(sketch, keys, percentiles=percentiles):
+    merged = sketch.groupby(keys + ["bucket"], as_index=False, observed=True)["count"].sum()
+    merged = merged[merged["count"] > 0].sort_values(keys + ["bucket"])
+    groups = merged.groupby(keys, observed=True)["count"]
+    cumulative = groups.cumsum()
+    totals = groups.transform("sum")
+    result = merged[keys].drop_duplicates().set_index(keys)
+    for percentile in percentiles:
+        reached = merged[cumulative >= totals * percentile / 100]
+        first = reached.groupby(keys, observed=True)["bucket"].first()
+        result[f"p{percentile}"] = pd.Series(bucket_values(first), index=first.index)
+    return result.reset_index()
+
+
+##### SKETCHES MATERIALIZATION #######
+
+# python sketch_api.py
+if __name__ == "__main__":
+    from spark_api import load_dataset
+
+    save_sketches(build_sketches(load_dataset()))
+    print("written", sketches_path)
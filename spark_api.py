@@ -4,55 +4,339 @@
 import pandas as pd
 from pyspark.sql import SparkSession
 from pyspark.sql.functions import *
-import json
-from pyspark.sql.types import StructType
 import pickle
+import os
+import datetime
+import hashlib
+import itertools
+import threading
+from urllib.parse import unquote, urlparse
+import numpy as np
+
+from cache_api import CacheStore, ResultCache, cache_max_bytes
+from cube_api import count_measure, get_source, load_cube, measure_sql, project, register_cube, register_sample, sum_measure
+from dimensions_api import register_dimensions, route_ends
+from executor_api import QueryCancelled, as_cancelled, background_pool, check_cancelled, run_parallel
+from index_api import adjacent_totals, build_adjacency, build_prefix_sums, build_window_index, range_sum, top_values
+from query_api import filter_date_range, query_spec, register_layout, run_spec
+from sample_api import deviations, load_sample, measure_deviations, with_error_bounds
+from sketch_api import build_sketches, load_sketches, merged_percentiles, percentiles, sketch_measures, sketch_place, with_period
+from storage_api import airlines_cancelled_diverted_path, load_file_stats, parquet_exists, parquet_path, read_csv, read_parquet
 
 ###### CONSTANTS ########
 
-spark = SparkSession.builder.appName("flights").getOrCreate()
+# arrow makes the conversion of the query results to pandas columnar, the FAIR
+# scheduler lets the independent queries run side by side (see executor_api.py)
+spark = SparkSession.builder.appName("flights").\
+            config("spark.sql.execution.arrow.pyspark.enabled", "true").\
+            config("spark.scheduler.mode", "FAIR").\
+            config("spark.scheduler.allocation.file", "file://" + os.path.abspath("util/fairscheduler.xml")).\
+            getOrCreate()
 cancelled_diverted = pd.read_csv("util/cancelled_diverted.csv")
 cancelled_diverted['FlightDate'] = pd.to_datetime(cancelled_diverted['FlightDate'])
 textual = pd.read_csv("util/textual_queries.csv")
 textual['FlightDate'] = pd.to_datetime(textual['FlightDate'])
+# days and years of the dataset: the 2013 ones until use_dates reads them
+# from the data
+dates = pickle.load(open("util/dates.pkl","rb"))
+years = sorted(int(year) for year in dates.dt.year.unique())
+
+# prefix sums of the daily totals shown by the textual widget: the totals of a
+# date range are two lookups per metric. use_indexes builds them again from
+# the dataset
+daily_totals = textual.set_index("FlightDate")[["count","delay_count","delay_sum"]].\
+                    join(cancelled_diverted.set_index("FlightDate")[["Cancelled","Diverted"]],
+                            how="outer")
+textual_index = build_prefix_sums(dates, daily_totals)
+
+# prefix sums of the daily cancelled and diverted flights per airline, if the
+# table has been generated (python storage_api.py cancellations); otherwise the
+# airline widget falls back to the whole-year cancellations
+cancellations = pd.read_csv("util/cancellations.csv")
+cancellations_index = None
+daily_cancelled_diverted = cancelled_diverted.set_index("FlightDate")[["Cancelled","Diverted"]]
+airlines_cancelled_diverted = None
+if os.path.exists(airlines_cancelled_diverted_path):
+    airlines_cancelled_diverted = pd.read_csv(airlines_cancelled_diverted_path)
+    airlines_cancelled_diverted['FlightDate'] = pd.to_datetime(airlines_cancelled_diverted['FlightDate'])
+    daily_cancelled_diverted = airlines_cancelled_diverted.groupby("FlightDate")[["Cancelled","Diverted"]].sum()
+    cancellations_index = build_prefix_sums(dates,
+                            airlines_cancelled_diverted.pivot(index="FlightDate",
+                                                                columns="Reporting_Airline",
+                                                                values=["Cancelled","Diverted"]))
+
+# days covered by the cancelled and diverted flights: util/cancelled_diverted.csv
+# and util/cancellations.csv only have the 2013 ones, python storage_api.py
+# cancellations counts them for all the raw files
+cancellations_coverage = (daily_cancelled_diverted.index.min(), daily_cancelled_diverted.index.max())
+
+def covers_cancellations(from_date,to_date):
+    first, last = cancellations_coverage
+    return first <= pd.Timestamp(from_date) and pd.Timestamp(to_date) <= last
+
+# note on the cancelled flights of the period: empty if they are counted for it,
+# otherwise what they cover
+
+def cancellations_note(from_date,to_date):
+    if not covers_cancellations(from_date,to_date):
+        return "not available for the period, run python storage_api.py cancellations"
+    if cancellations_index is None:
+        return "whole " + str(cancellations_coverage[0].year)
+    return ""
+
+# prefix sums of the daily flights and arrival delays per airline, of the
+# flights per (Month, DayofMonth) of every place column and of the daily
+# flights and arrival delays of the routes of every origin, built by
+# use_indexes for the dataset indexed_source
+airlines_index = None
+places_indexes = {}
+routes_adjacency = None
+indexed_source = None
+
+# attributes of a route, that depend only on its origin and destination
+route_attributes = ["ORIGIN_STATE","DEST_STATE","ORIGIN_LATITUDE","ORIGIN_LONGITUDE","DEST_LATITUDE","DEST_LONGITUDE"]
+
+# dataset of the dashboard and cache of its query results, see use_dataset.
+# The fingerprint of the dataset prefixes the cache keys, so the results of
+# another version of the data stored in util/cache.sqlite are never used
+dataset = None
+result_cache = None
+dataset_fingerprint = ""
+
+# stratified sample of the dataset, for the approximate queries
+approximate_source = None
+
+# set in the threads that run a plot with fetch answering only from the cache
+# (see cached_only)
+cache_only = threading.local()
+
+# delay sketches per day and place, (place, measure) -> sketch, built by
+# use_sketches for the dataset sketches_source
+sketches = {}
+sketches_source = None
 
 
 column_aliases = {"DEST_STATE_FULL_NAME": "Destination state", "ORIGIN_STATE_FULL_NAME": "Origin state", "DEST_AIRPORT_FULL_NAME": "Destination airport", 
                     "ORIGIN_AIRPORT_FULL_NAME": "Origin airport"}
 
-column_per_aggregation_level = {"Daily": "FlightDate", "Weekly": "WeekofMonth", "Monthly": "Month"}
+column_per_aggregation_level = {"Daily": "FlightDate", "Weekly": "WeekofMonth", "Monthly": "Month", "Yearly": "Year"}
 
 ###### UTIL FUNCTIONS ########
 
 # cache management
 
-def load_cache():
-    # check if util/cache.pkl exists
-    # if not create it
-    try:
-        cache = pickle.load(open("util/cache.pkl","rb"))
-    except:
-        cache = {}
+# cache of the query results (pandas dataframes, see fetch). The entries are
+# read lazily from the on-disk store (util/cache.sqlite) and the new ones are
+# written by cache.flush()
+
+def load_cache(max_bytes=cache_max_bytes, policy="lru", ttl=None):
+    store = CacheStore()
+    store.start_compaction()
+    cache = ResultCache(max_bytes, policy, ttl, store)
     return cache
 
 # dataset retrieval
 
-def load_dataset():
-    with open("util/schema.json","r") as f:
-        schema = StructType.fromJson(json.load(f))
-    
-    
-    df = spark.read.csv("data.nosync/cleaned/cleaned_flights.csv",
-                                            schema=schema, header=True)
+# storage can be "csv", "parquet" or "auto" (parquet if the converted
+# dataset exists, see storage_api.py)
+
+def load_dataset(storage="auto"):
+    if storage == "parquet" or (storage == "auto" and parquet_exists()):
+        df = read_parquet(spark)
+        # the queries filtered on the clustered columns read only their files
+        register_layout(df, parquet_path, load_file_stats())
+    else:
+        df = read_csv(spark)
 
     return df
 
+# build (or read, if materialized with python cube_api.py) the daily cube of
+# df: from now on the queries on df are answered from the cube when they can
+
+def use_cube(df):
+    cube = load_cube(spark, df)
+    register_cube(cube, df)
+    return cube
+
+# draw (or read, if materialized with python sample_api.py) the stratified
+# sample of df: the queries run on it give approximate results (see fetch)
+
+def use_sample(df):
+    global approximate_source
+    sample = load_sample(spark, df)
+    register_sample(sample)
+    deviations.update(measure_deviations(sample))
+    approximate_source = sample
+    return sample
+
+def get_sample():
+    return approximate_source
+
+# read the days and the years of df (answered by the cube if it's
+# registered), so the sliders and the prefix sums cover all of them
+
+def use_dates(df):
+    global dates, years, cancellations_index
+    days = run_spec(query_spec(["FlightDate"],[("count","count",None)]),df).toPandas()
+    dates = pd.Series(sorted(pd.to_datetime(days["FlightDate"])))
+    years = sorted(int(year) for year in dates.dt.year.unique())
+    if airlines_cancelled_diverted is not None:
+        cancellations_index = build_prefix_sums(dates,
+                                airlines_cancelled_diverted.pivot(index="FlightDate",
+                                                                    columns="Reporting_Airline",
+                                                                    values=["Cancelled","Diverted"]))
+
+# build the per-airline prefix sums of df (a single small aggregation, answered
+# by the cube if it's registered) and from them the ones of the textual widget,
+# the window indexes of the place columns (a single scan for the four of them)
+# and the adjacency of the routes
+
+def use_indexes(df):
+    global airlines_index, textual_index, places_indexes, routes_adjacency, indexed_source
+    daily_measures = [("count","count",None),("ArrDelay","sum","ArrDelay")]
+    daily = run_spec(query_spec(["FlightDate","Reporting_Airline"],daily_measures),df).toPandas()
+    daily["FlightDate"] = pd.to_datetime(daily["FlightDate"])
+    per_day = daily.groupby("FlightDate")[["count","ArrDelay"]].sum()
+    # every flight of the cleaned dataset counts in delay_count, as in util/textual_queries.csv
+    textual_totals = pd.DataFrame({"count": per_day["count"], "delay_count": per_day["count"],
+                                    "delay_sum": per_day["ArrDelay"]}).\
+                        join(daily_cancelled_diverted, how="outer")
+    textual_index = build_prefix_sums(dates, textual_totals)
+    daily = daily.pivot(index="FlightDate",columns="Reporting_Airline",values=["count","ArrDelay"])
+    airlines_index = build_prefix_sums(dates, daily)
+
+    places = list(column_aliases)
+    frames = batch_query(df, [(["Year","Month","DayofMonth",place], [("count","count",None)]) for place in places])
+    places_indexes = {place: build_window_index(frame, place) for place, frame in zip(places, frames)}
+
+    daily = run_spec(query_spec(["Origin","Dest","FlightDate"]+route_attributes,daily_measures),df).toPandas()
+    routes_adjacency = build_adjacency(dates, daily, route_attributes)
+    indexed_source = df
+
+# restrict the airports, states and airlines of the dimension registry (see
+# dimensions_api.py) to the ones of df, with its place names for the dropdowns:
+# a single small query, answered by the cube if it's registered
+
+def use_dimensions(df):
+    route_keys = [column for code, columns in route_ends.items() for column in (code, *columns)]
+    routes, airlines = batch_query(df, [(route_keys, [("count","count",None)]),
+                                        (["Reporting_Airline"], [("count","count",None)])])
+    register_dimensions(routes, airlines)
+
+# read (or build, if not materialized with python sketch_api.py) the delay
+# sketches of df, see sketch_api.py
+
+def use_sketches(df):
+    global sketches, sketches_source
+    sketches = load_sketches()
+    if sketches is None:
+        sketches = build_sketches(df)
+    sketches_source = df
+
+# fingerprint of df: its files with their modification times, its number of
+# flights and its first and last day (the count is answered by the cube if
+# it's registered)
+
+def fingerprint(df):
+    files = []
+    for uri in sorted(df.inputFiles()):
+        path = unquote(urlparse(uri).path)
+        files.append((uri, os.path.getmtime(path) if os.path.exists(path) else None))
+    flights = run_spec(query_spec([],[("count","count",None)]),df).collect()[0]["count"]
+    span = (normalize(dates.iloc[0]), normalize(dates.iloc[len(dates) - 1])) if len(dates) > 0 else None
+    return hashlib.sha1(repr((files, flights, span)).encode()).hexdigest()[:16]
+
+# register df as the dataset of the dashboard: its cube, its days, its
+# airports, states and airlines, its sample, its prefix sums, its delay sketches and the cache of its query results
+
+def use_dataset(df, cache=None):
+    global dataset, result_cache, dataset_fingerprint
+    use_cube(df)
+    use_dates(df)
+    dataset_fingerprint = fingerprint(df)
+    # the registry, the sample, the indexes and the sketches are independent,
+    # their queries run side by side
+    run_parallel([(use_dimensions, (df,)), (use_sample, (df,)), (use_indexes, (df,)), (use_sketches, (df,))],
+                    pool=background_pool)
+    dataset = df
+    result_cache = cache
+
+# cache key of a query: the fingerprint of the dataset, the name of the query
+# and its normalized parameters (dates as ISO strings, the lists of places
+# sorted since they are only used with isin)
+
+def normalize(value):
+    if isinstance(value, (datetime.date, np.datetime64)):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, (list, tuple, set)):
+        return tuple(sorted(normalize(item) for item in value))
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def query_key(query, args):
+    return dataset_fingerprint + " query " + query.__name__ + " " + repr(tuple(normalize(arg) for arg in args))
+
+# result of query(df, *args) as a pandas dataframe. On the dataset of the
+# dashboard it's cached, so the widgets that run the same query share it and
+# the plots are built from the cached result; callers get their own copy.
+# The widget updates cancelled in the meantime stop here (see executor_api.py).
+# On the sample the result is approximate, with its error bounds
+
+def fetch(query, df, *args):
+    check_cancelled()
+    if df is approximate_source and df is not None:
+        return with_error_bounds(query(df, *args).toPandas())
+    if getattr(cache_only, "active", False):
+        missing = object()
+        result = result_cache.get(query_key(query, args), missing) if result_cache is not None and df is dataset else missing
+        if result is missing:
+            raise NotCached(query.__name__)
+        return result.copy()
+    if result_cache is None or df is not dataset:
+        return query(df, *args).toPandas()
+    # the queries over sets of days are merged from cached per-day partials.
+    # The errors of a cancelled update reach the waiters as QueryCancelled
+    def compute():
+        check_cancelled()
+        try:
+            if query in composable_queries:
+                return composable_queries[query](df, *args)
+            return query(df, *args).toPandas()
+        except Exception as error:
+            raise as_cancelled(error)
+    result = result_cache.get_or_compute(query_key(query, args), compute)
+    return result.copy()
+
+# raised by fetch under cached_only for a result that isn't cached
+
+class NotCached(Exception):
+    pass
+
+# function(*args) with fetch answering only from the cache, without running
+# spark queries: NotCached if a result it needs isn't cached
+
+def cached_only(function, *args):
+    cache_only.active = True
+    try:
+        return function(*args)
+    finally:
+        cache_only.active = False
+
 # get the unique dates from pickle
 
 def get_dates():
-    dates = pickle.load(open("util/dates.pkl","rb"))
     return dates
 
+def get_years():
+    return years
+
+# the range of years of the window widgets, all the years when not given
+
+def year_range(start_year=None, end_year=None):
+    return (years[0] if start_year is None else start_year,
+            years[len(years) - 1] if end_year is None else end_year)
+
 def get_column_aliases():
     return column_aliases
 
@@ -65,223 +349,535 @@ def get_column_per_agg_level():
     return column_per_aggregation_level
 
 
-def get_destinations(destination_type):
-    file_path = "serialized_objects/" + destination_type + ".pkl"
-    loaded_destinations = None
-    with open(file_path, "rb") as f:
-        loaded_destinations = pickle.load(f)
-    return loaded_destinations        
-
-def get_origins(origin_type):
-    file_path = "serialized_objects/" + origin_type + ".pkl"
-    loaded_origins = None
-    with open(file_path, 'rb') as f:
-        loaded_origins = pickle.load(f)
-    return loaded_origins
-
 
 
 ###### QUERIES ########
 
+# every query is a query spec (see query_api.py) and a thin wrapper that runs
+# it with its parameters: the spec is compiled on the cube registered with
+# use_cube if it contains all the columns the query needs (or on the sample),
+# on df otherwise, with the measures of cube_api that give the same result on
+# both
+
 # heatmap query
 
+# the averages come with the number of flights they are made of, from which the
+# previews on the sample compute their error bounds (see sample_api.py)
+
+def matrix_spec(x,y,z="count"):
+    measures = [(f"{z}_agg","count",None)] if z=="count" else [(f"{z}_agg","avg",z),("count","count",None)]
+    return query_spec([x,y],measures)
+
 def matrix_agg(df,x,y,z="count"):
-    if z=="count":
-        df_aggregated = df.groupBy(x,y).agg({"*": "count"}).\
-                                    withColumnRenamed(f"count(1)", f"{z}_agg")
-    else:
-        df_aggregated = df.groupBy(x,y).agg({z: "avg"}).\
-                                    withColumnRenamed(f"avg({z})", f"{z}_agg")
-    return df_aggregated
+    return run_spec(matrix_spec(x,y,z),df)
 
 # pie chart query
 
 
-def origin_dest_query(df,from_date,to_date,query="ArrDelay"):
-    # filter the dataframe using timestamp from_date and to_date
-    df = df.filter(df["FlightDate"].between(from_date,to_date))
-    
-    if query=="count":
-        df = df.groupBy("ORIGIN_STATE","DEST_STATE").agg({"*": "count"}).\
-                                    withColumnRenamed("count(1)", "count")
-    else:
-        df = df.groupBy("ORIGIN_STATE","DEST_STATE").agg({"ArrDelay": "avg"}).\
-                                withColumnRenamed("avg(ArrDelay)", "ArrDelay")
-
-    # order by query, descendant order
-    df = df.orderBy(df[query].desc())
+def origin_dest_spec(query="ArrDelay"):
+    measures = [("count","count",None)] if query=="count" else [("ArrDelay","avg","ArrDelay"),("count","count",None)]
+    # filter on the period and order by query, descendant order
+    return query_spec(["ORIGIN_STATE","DEST_STATE"],measures,
+                        filters=[("date_range","FlightDate","from_date","to_date")],
+                        order=[(query,False)])
 
-    return df
+def origin_dest_query(df,from_date,to_date,query="ArrDelay"):
+    return run_spec(origin_dest_spec(query),df,from_date=from_date,to_date=to_date)
 
 # map routes query
 
-def routes_queries(df,date_start,date_end,origin="BOS",query="NumFlights",scope="airports"):
-    # filter 
-    df_aggregated = df.filter((col("Origin") == origin))
-    df_aggregated = df_aggregated.filter((col("FlightDate") >= date_start) & 
-                                                    (col("FlightDate") <= date_end))
-
-    # group by
+def routes_spec(query="NumFlights",scope="airports"):
+    measures = [("AverageArrivalDelay","avg","ArrDelay"),("NumFlights","count",None)]
     if scope == "airports":
-        df_aggregated = df_aggregated.\
-                    groupBy("Origin","Dest","ORIGIN_LATITUDE","ORIGIN_LONGITUDE",
-                                    "DEST_LATITUDE","DEST_LONGITUDE").\
-                    agg({"ArrDelay": "avg","*":"count"}).\
-                    withColumnRenamed("avg(ArrDelay)", "AverageArrivalDelay").\
-                    withColumnRenamed("count(1)", "NumFlights")
+        keys = ["Origin","Dest","ORIGIN_LATITUDE","ORIGIN_LONGITUDE","DEST_LATITUDE","DEST_LONGITUDE"]
     else:
-        df_aggregated = df_aggregated.groupBy("ORIGIN_STATE","DEST_STATE").\
-                    agg({"ArrDelay": "avg","*":"count","ORIGIN_LATITUDE":"avg",
-                        "DEST_LATITUDE":"avg","ORIGIN_LONGITUDE":"avg",
-                        "DEST_LONGITUDE":"avg"}).\
-                    withColumnRenamed("avg(ArrDelay)", "AverageArrivalDelay").\
-                    withColumnRenamed("count(1)", "NumFlights")
+        # the coordinates of a state are the mean of its airports, weighted
+        # by the number of flights
+        keys = ["ORIGIN_STATE","DEST_STATE"]
+        measures += [(coordinate,"avg",coordinate) for coordinate in
+                        ["ORIGIN_LATITUDE","DEST_LATITUDE","ORIGIN_LONGITUDE","DEST_LONGITUDE"]]
+    # sort by query: all the routes are kept, the map draws them in a single trace
+    return query_spec(keys,measures,
+                        filters=[("eq","Origin","origin"),("date_range","FlightDate","date_start","date_end")],
+                        order=[(query,False)])
+
+def routes_queries(df,date_start,date_end,origin="BOS",query="NumFlights",scope="airports"):
+    return run_spec(routes_spec(query,scope),df,origin=origin,date_start=date_start,date_end=date_end)
 
-        # rename columns
-        df_aggregated = df_aggregated.withColumnRenamed("avg(ORIGIN_LATITUDE)", "ORIGIN_LATITUDE").\
-                                    withColumnRenamed("avg(ORIGIN_LONGITUDE)", "ORIGIN_LONGITUDE").\
-                                    withColumnRenamed("avg(DEST_LATITUDE)", "DEST_LATITUDE").\
-                                    withColumnRenamed("avg(DEST_LONGITUDE)", "DEST_LONGITUDE")
+# routes of the period as a pandas dataframe: from the adjacency of the origin
+# built by use_indexes when available, with a spark query otherwise
 
-    # sort by query and take the first 100 rows
-    df_aggregated = df_aggregated.orderBy(df_aggregated[query].desc()).limit(100)
+def routes_totals(df,date_start,date_end,origin="BOS",query="NumFlights",scope="airports"):
+    if routes_adjacency is None or df is not indexed_source:
+        return fetch(routes_queries,df,date_start,date_end,origin,query,scope)
+
+    if origin in routes_adjacency:
+        routes = adjacent_totals(routes_adjacency,origin,date_start,date_end)
+    else:
+        routes = pd.DataFrame(columns=route_attributes+["count","ArrDelay"])
+    routes = routes.rename_axis("Dest").reset_index().assign(Origin=origin)
+    routes = routes[routes["count"] > 0].rename(columns={"count": "NumFlights"})
+    routes["NumFlights"] = routes["NumFlights"].astype("int64")
 
-    return df_aggregated
+    return shape_routes(routes,query,scope)
 
 
 # states map query
 
-def states_map_query(df,group):
-    df_aggregated = df.groupBy(group).\
-                        agg({"ArrDelay": "avg", "*":"count"}).\
-                        withColumnRenamed("avg(ArrDelay)", "ArrDelay")
+def states_map_spec(group):
+    return query_spec([group],[("ArrDelay","avg","ArrDelay"),("count","count",None)])
 
-    df_aggregated = df_aggregated.withColumnRenamed("count(1)","count")
-    return df_aggregated
+def states_map_query(df,group):
+    return run_spec(states_map_spec(group),df)
 
 # reporting airlines query
 
-def reporting_airlines_queries(df,from_date,to_date,query="count"):
-    # get the tuples in between the dates
-    df = df.filter(df["FlightDate"].between(from_date,to_date))
-
+def reporting_airlines_spec(query="count"):
     if query == "count":
-        df_agg = df.groupBy("Reporting_Airline").\
-            agg({"*": "count"}).\
-            withColumnRenamed("count(1)", "count").\
-            orderBy("count", ascending=False)
+        measure = ("count","count",None)
     elif query == "Cancelled":
-        df_agg = df.groupBy("Reporting_Airline").\
-            agg({"Cancelled": "sum"}).\
-            withColumnRenamed("sum(Cancelled)", "Cancelled").\
-            orderBy("Cancelled", ascending=False)
+        measure = ("Cancelled","sum","Cancelled")
     else:
-        df_agg=df.groupBy("Reporting_Airline").\
-            agg({"ArrDelay": "avg"}).\
-            withColumnRenamed("avg(ArrDelay)", "ArrDelay").\
-            orderBy("ArrDelay", ascending=False)        
-    
-    return df_agg
+        measure = ("ArrDelay","avg","ArrDelay")
+    measures = [measure] if query=="count" else [measure,("count","count",None)]
+    # get the tuples in between the dates
+    return query_spec(["Reporting_Airline"],measures,
+                        filters=[("date_range","FlightDate","from_date","to_date")],
+                        order=[(measure[0],False)])
+
+def reporting_airlines_queries(df,from_date,to_date,query="count"):
+    return run_spec(reporting_airlines_spec(query),df,from_date=from_date,to_date=to_date)
+
+# per-airline totals of the period as a pandas dataframe: from the prefix sums
+# built by use_indexes when available, with a spark query otherwise
+
+def reporting_airlines_totals(df,from_date,to_date,query="count"):
+    if query == "Cancelled":
+        return reporting_airlines_cancelled(from_date,to_date)
+    if airlines_index is None or df is not indexed_source:
+        return fetch(reporting_airlines_queries,df,from_date,to_date,query)
+
+    totals = range_sum(airlines_index,from_date,to_date)
+    df_agg = pd.DataFrame({"count": totals["count"].astype("int64"),
+                            "ArrDelay": totals["ArrDelay"]/totals["count"]})
+    # airlines without flights in the period are not in the result
+    df_agg = df_agg[df_agg["count"] > 0]
+    y = "count" if query == "count" else "ArrDelay"
+    df_agg = df_agg[[y] if query == "count" else [y,"count"]].sort_values(by=y,ascending=False)
+
+    return df_agg.rename_axis("Reporting_Airline").reset_index()
+
+# cancelled flights per airline in the period, none if the period is not
+# covered by the cancellations (see cancellations_note)
+
+def reporting_airlines_cancelled(from_date,to_date):
+    if not covers_cancellations(from_date,to_date):
+        return pd.DataFrame({"Reporting_Airline": pd.Series(dtype=object), "Cancelled": pd.Series(dtype="float64")})
+    if cancellations_index is None:
+        return cancellations.sort_values(by="Cancelled",ascending=False)
+
+    totals = range_sum(cancellations_index,from_date,to_date)
+    df_agg = totals["Cancelled"].rename("Cancelled").to_frame()
+    df_agg = df_agg.sort_values(by="Cancelled",ascending=False)
+
+    return df_agg.rename_axis("Reporting_Airline").reset_index()
 
 # scatter plot query
 
+scatter_measures = ["ArrDelay","TaxiIn","TaxiOut","DepDelay","AirTime","Distance"]
+
+def scatter_spec(temp_granularity):
+    return query_spec([temp_granularity],
+                        [("count","count",None)] +
+                        [(measure,"avg",measure) for measure in scatter_measures] +
+                        [("avg(DepTime)","avg","DepTime"),("avg(ArrTime)","avg","ArrTime")])
+
 def scatter_queries(df,temp_granularity):
-    df_agg =(df.groupBy(temp_granularity).\
-    agg({"ArrDelay": "avg","TaxiIn":"avg","TaxiOut":"avg","DepDelay":"avg",
-            "DepTime":"avg","ArrTime":"avg","AirTime":"avg","Distance":"avg",
-            "*":"count"}).\
-        withColumnRenamed("count(1)", "count").\
-        withColumnRenamed("avg(ArrDelay)", "ArrDelay").\
-        withColumnRenamed("avg(TaxiIn)", "TaxiIn").\
-        withColumnRenamed("avg(TaxiOut)", "TaxiOut").\
-        withColumnRenamed("avg(DepDelay)", "DepDelay").\
-        withColumnRenamed("avg(AirTime)", "AirTime").\
-        withColumnRenamed("avg(Distance)", "Distance"))
-    return df_agg
+    return run_spec(scatter_spec(temp_granularity),df)
 
 # textual query
 
 def textual_queries(df,from_date,to_date):
-    df = df.filter(df["FlightDate"].between(from_date,to_date))
-    # filter textual pandas dataframe using the dates
-    textual_filtered = textual[(textual['FlightDate'] >= from_date) &
-                                (textual['FlightDate'] <= to_date)]
+    # totals of the period from the prefix sums of the daily totals
+    totals = range_sum(textual_index,from_date,to_date)
     
-    num = textual_filtered["count"].sum()
-    delayed = textual_filtered["delay_count"].sum()
-    average_delay = textual_filtered["delay_sum"].sum()/num
+    num = int(totals["count"])
+    delayed = int(totals["delay_count"])
+    average_delay = totals["delay_sum"]/num
     
-    cd_filtered = cancelled_diverted[(cancelled_diverted['FlightDate'] >= from_date) & 
-                    (cancelled_diverted['FlightDate'] <= to_date)]
-    
-    cancelled = cd_filtered['Cancelled'].sum()
-    diverted = cd_filtered['Diverted'].sum()
+    # None if the period is not covered by the cancellations
+    cancelled = totals["Cancelled"] if covers_cancellations(from_date,to_date) else None
+    diverted = totals["Diverted"] if covers_cancellations(from_date,to_date) else None
 
+    return [num,cancelled,delayed,diverted,average_delay]
 
+# top or bottom x places of the window as a pandas dataframe: from the window
+# index of the place column when available, with a spark query otherwise
 
-    return [num,cancelled,delayed,diverted,average_delay]
+def x_places_totals(flights_df, x, start_month, end_month, start_day, end_day, place_attribute, sort_by, start_year=None, end_year=None):
+    start_year, end_year = year_range(start_year, end_year)
+    if place_attribute not in places_indexes or flights_df is not indexed_source:
+        return fetch(compute_x_places_by_interval, flights_df, x, start_month, end_month, start_day, end_day, place_attribute, sort_by, start_year, end_year)
 
-# plot della classifica dei primi x migliori in base allo stato di destinazione o aereporto di destinazione. 
-def compute_x_places_by_interval(flights_df, x, start_month, end_month, start_day, end_day, place_attribute, sort_by): 
-    flights_per_places = flights_df.filter((start_month <= flights_df.Month) \
-                                            & (flights_df.Month <= end_month) \
-                                            & (start_day <= flights_df.DayofMonth) \
-                                            & (flights_df.DayofMonth <= end_day)).\
-                                    select(col(place_attribute)).\
-                                    groupBy(col(place_attribute)).\
-                                    count()
-
-    if sort_by == "Top":
-        flights_per_places = flights_per_places.sort(col("count").desc())
-    else:
-        flights_per_places = flights_per_places.sort(col("count").asc())
-                                    
-    # prendo le prime top x destinazioni 
-    places = flights_per_places.limit(x)
-    # Rinomino le colonne per rendere il grafico più comprensibile
-    places = places.withColumnRenamed("count", "Count")
+    totals = top_values(places_indexes[place_attribute], x, start_month, end_month, start_day, end_day, sort_by == "Top", start_year, end_year)
+    places = totals.astype("int64").rename("Count").rename_axis(place_attribute).reset_index()
 
     return places
 
-
-def compute_flights_per_place(flights_df, start_month, end_month, start_day, end_day, place_attribute):
-    flights_per_place_column = flights_df.filter((start_month <= flights_df.Month) \
-                                            & (flights_df.Month <= end_month) \
-                                            & (start_day <= flights_df.DayofMonth) \
-                                            & (flights_df.DayofMonth <= end_day)).\
-                                    select(col(place_attribute), "FlightDate").\
-                                    groupBy(col(place_attribute), "FlightDate").\
-                                    count().\
-                                    orderBy(col("FlightDate"))
-    return flights_per_place_column
+# plot della classifica dei primi x migliori in base allo stato di destinazione o aereporto di destinazione. 
+# filtro sulla finestra di mesi e giorni del mese, negli anni selezionati
+window_filters = [("between", "Year", "start_year", "end_year"), ("between", "Month", "start_month", "end_month"),
+                  ("between", "DayofMonth", "start_day", "end_day")]
+
+def x_places_spec(place_attribute, sort_by):
+    # prendo le prime top x destinazioni, con la colonna Count per rendere il grafico più comprensibile
+    return query_spec([place_attribute], [("Count", "count", None)],
+                        filters=window_filters,
+                        order=[("Count", sort_by != "Top")],
+                        limit="x")
+
+def compute_x_places_by_interval(flights_df, x, start_month, end_month, start_day, end_day, place_attribute, sort_by, start_year=None, end_year=None): 
+    start_year, end_year = year_range(start_year, end_year)
+    return run_spec(x_places_spec(place_attribute, sort_by), flights_df, x=x, start_year=start_year, end_year=end_year,
+                    start_month=start_month, end_month=end_month, start_day=start_day, end_day=end_day)
+
+
+# daily flights of the window of the given places only (the top or bottom x of
+# x_places_totals): the short list of places is a filter pushed down to the
+# scan, so the other places are never aggregated nor collected
+
+def flights_per_place_spec(place_attribute):
+    return query_spec([place_attribute, "FlightDate"], [("count", "count", None)],
+                        filters=window_filters + [("isin", place_attribute, "places")],
+                        order=[("FlightDate", True)])
+
+def compute_flights_per_place(flights_df, places, start_month, end_month, start_day, end_day, place_attribute, start_year=None, end_year=None):
+    start_year, end_year = year_range(start_year, end_year)
+    return run_spec(flights_per_place_spec(place_attribute), flights_df, places=list(places), start_year=start_year, end_year=end_year,
+                    start_month=start_month, end_month=end_month, start_day=start_day, end_day=end_day)
+
+def flights_per_selected_place_spec(place_column):
+    return query_spec(["FlightDate"], [("count", "count", None)],
+                        filters=[("eq", place_column, "place")],
+                        order=[("FlightDate", True)])
 
 def compute_flights_per_selected_place(flights_df, place_column, place):
-    flights_per_selected_place = flights_df.filter((flights_df[place_column] == place)).\
-                                            select("FlightDate").\
-                                            groupBy("FlightDate").\
-                                            count().\
-                                            orderBy(col("FlightDate"))
-    return flights_per_selected_place
+    return run_spec(flights_per_selected_place_spec(place_column), flights_df, place=place)
     
 
-def compute_mean_arr_delay_per_dest(flights_df, destinations, dest_attribute, aggregation_level):
+# average of a delay measure per place and period, for the line charts
+
+def mean_delay_spec(place_attribute, measure, aggregation_level):
     period = column_per_aggregation_level[aggregation_level]
-    mean_arr_delay_per_dest = flights_df.filter(flights_df[dest_attribute].isin(destinations)).\
-                                    select(col(dest_attribute), period, "ArrDelayMinutes").\
-                                    groupBy(col(dest_attribute), period).\
-                                    agg({"ArrDelayMinutes": "avg"}).\
-                                    orderBy(col(period))
+    return query_spec([place_attribute, period], [(f"avg({measure})", "avg", measure), ("count", "count", None)],
+                        filters=[("isin", place_attribute, "places")],
+                        order=[(period, True)])
 
-    return mean_arr_delay_per_dest
+def compute_mean_arr_delay_per_dest(flights_df, destinations, dest_attribute, aggregation_level):
+    return run_spec(mean_delay_spec(dest_attribute, "ArrDelayMinutes", aggregation_level), flights_df, places=destinations)
     
 
 def compute_mean_dep_delay_per_origin(flights_df, origins, origin_attribute, aggregation_level):
+    return run_spec(mean_delay_spec(origin_attribute, "DepDelayMinutes", aggregation_level), flights_df, places=origins)
+
+
+# percentiles of the delays (the columns p50, p90, p99) merged from the
+# sketches, with spark's approximate percentiles when df has no sketches.
+# The sample of the dataset is served by the sketches of the dataset
+
+def has_sketches(df, place_attribute):
+    return sketch_place(place_attribute) is not None and sketches_source is not None and \
+                (df is sketches_source or df is approximate_source)
+
+def place_list(places):
+    return [places] if isinstance(places, str) else list(places)
+
+def percentile_measures(measure, suffix=""):
+    return [(f"p{percentile}{suffix}", f"p{percentile}", measure) for percentile in percentiles]
+
+# arrival and departure delay percentiles of every place between two dates,
+# in the columns p50(ArrDelayMinutes), ...
+
+def delay_percentiles_spec(place_attribute):
+    return query_spec([place_attribute],
+                        [measure for delay in sketch_measures for measure in percentile_measures(delay, f"({delay})")],
+                        filters=[("date_range", "FlightDate", "from_date", "to_date"), ("isin", place_attribute, "places")])
+
+def compute_delay_percentiles(flights_df, from_date, to_date, places, place_attribute):
+    return run_spec(delay_percentiles_spec(place_attribute), flights_df,
+                    from_date=from_date, to_date=to_date, places=place_list(places))
+
+def delay_percentiles(flights_df, from_date, to_date, places, place_attribute):
+    if not has_sketches(flights_df, place_attribute):
+        return fetch(compute_delay_percentiles, flights_df, from_date, to_date, places, place_attribute)
+
+    frames = []
+    for measure in sketch_measures:
+        sketch = sketches[(sketch_place(place_attribute), measure)]
+        selected = sketch[sketch["FlightDate"].between(pd.Timestamp(from_date), pd.Timestamp(to_date)) &
+                            sketch[place_attribute].isin(place_list(places))]
+        merged = merged_percentiles(selected, [place_attribute]).set_index(place_attribute)
+        frames.append(merged.rename(columns=lambda column: f"{column}({measure})"))
+
+    return pd.concat(frames, axis=1).reset_index()
+
+# percentiles of a delay measure per place and period, for the line charts
+
+def delay_percentiles_per_period_spec(place_attribute, measure, aggregation_level):
     period = column_per_aggregation_level[aggregation_level]
+    return query_spec([place_attribute, period], percentile_measures(measure),
+                        filters=[("isin", place_attribute, "places")],
+                        order=[(period, True)])
+
+def compute_delay_percentiles_per_period(flights_df, places, place_attribute, measure, aggregation_level):
+    return run_spec(delay_percentiles_per_period_spec(place_attribute, measure, aggregation_level), flights_df,
+                    places=place_list(places))
 
-    mean_dep_delay_per_origin = flights_df.filter(flights_df[origin_attribute].isin(origins)).\
-                                    select(col(origin_attribute), period, "DepDelayMinutes").\
-                                    groupBy(col(origin_attribute), period).\
-                                    agg({"DepDelayMinutes": "avg"}).\
-                                    orderBy(col(period))
+def delay_percentiles_per_period(flights_df, places, place_attribute, measure, aggregation_level):
+    if not has_sketches(flights_df, place_attribute):
+        return fetch(compute_delay_percentiles_per_period, flights_df, places, place_attribute, measure, aggregation_level)
 
-    return mean_dep_delay_per_origin
+    period = column_per_aggregation_level[aggregation_level]
+    sketch = sketches[(sketch_place(place_attribute), measure)]
+    selected = with_period(sketch[sketch[place_attribute].isin(place_list(places))], period)
+    merged = merged_percentiles(selected, [place_attribute, period])
+
+    return merged.sort_values(by=period).reset_index(drop=True)
+
+
+###### PARTIAL AGGREGATES ########
+
+# the days of the dataset between two dates, or in a window of months and days
+# of the month of a range of years (the sliders of the pie, histogram and
+# facet widgets)
+
+def days_between(from_date, to_date):
+    return list(dates[(dates >= from_date) & (dates <= to_date)])
+
+def days_in_window(start_month, end_month, start_day, end_day, start_year=None, end_year=None):
+    start_year, end_year = year_range(start_year, end_year)
+    return list(dates[dates.dt.year.between(start_year, end_year) &
+                        dates.dt.month.between(start_month, end_month) &
+                        dates.dt.day.between(start_day, end_day)])
+
+# count and sums of measures grouped by keys, for each of the days. The
+# partial of every day is cached under the name shape, and only the days
+# missing from the cache are computed (with a single spark query); condition
+# is an extra filter, that must be part of shape. The partials are summed
+# over the days
+
+def daily_partials(df, shape, days, keys, measures, condition=None):
+    partial_key = lambda day: dataset_fingerprint + " partial " + shape + " " + normalize(day)
+    missing = object()
+    partials = {}
+    for day in days:
+        partial = result_cache.get(partial_key(day), missing)
+        if partial is not missing:
+            partials[day] = partial
+
+    # the days already being computed by another request are waited for
+    todo = [day for day in days if day not in partials]
+    todo_keys = {partial_key(day): day for day in todo}
+    mine, others = result_cache.claim(list(todo_keys))
+    todo = [todo_keys[key] for key in mine]
+    try:
+        compute_partials(df, todo, keys, measures, condition, partials)
+    except Exception as error:
+        error = as_cancelled(error)
+        for key in mine:
+            result_cache.release(key, error=error)
+        raise error
+    for key in mine:
+        result_cache.put(key, partials[todo_keys[key]])
+        result_cache.release(key, partials[todo_keys[key]])
+    # the days of a request that was cancelled are computed again, the other
+    # errors are raised as they are
+    failed = []
+    for key, flight in others.items():
+        try:
+            partials[todo_keys[key]] = flight.wait(check_cancelled)
+        except QueryCancelled:
+            check_cancelled()
+            failed.append(todo_keys[key])
+    compute_partials(df, failed, keys, measures, condition, partials)
+    for day in failed:
+        result_cache.put(partial_key(day), partials[day])
+
+    if len(days) == 0:
+        return pd.DataFrame(columns=keys + ["count"] + measures)
+    return pd.concat([partials[day] for day in days]).groupby(keys, as_index=False).sum()
+
+# partials of the days in todo with a single spark query, stored in partials
+
+def compute_partials(df, todo, keys, measures, condition, partials):
+    if len(todo) > 0:
+        check_cancelled()
+        columns = keys + measures
+        source, from_cube = get_source(df, columns + ["FlightDate"])
+        if condition is not None:
+            source = source.filter(condition)
+        source = filter_date_range(source, todo[0], todo[-1]).filter(col("FlightDate").isin(todo))
+        computed = project(source, columns + ["FlightDate"], from_cube).\
+                        groupBy("FlightDate", *keys).\
+                        agg(count_measure(from_cube), *[sum_measure(m, from_cube) for m in measures]).\
+                        toPandas()
+        # days without flights are cached as empty partials
+        empty = computed.iloc[0:0].drop(columns="FlightDate")
+        computed = {day: partial.drop(columns="FlightDate") for day, partial in computed.groupby("FlightDate")}
+        for day in todo:
+            partials[day] = computed.get(pd.Timestamp(day), empty)
+
+# pandas versions of the queries over sets of days, with the same result
+
+def origin_dest_from_partials(df,from_date,to_date,query="ArrDelay"):
+    keys = ["ORIGIN_STATE","DEST_STATE"]
+    merged = daily_partials(df,"origin_dest",days_between(from_date,to_date),keys,["ArrDelay"])
+    merged["ArrDelay"] = merged["ArrDelay"]/merged["count"]
+    columns = keys+[query] if query=="count" else keys+[query,"count"]
+    return merged[columns].sort_values(by=query,ascending=False).reset_index(drop=True)
+
+def routes_from_partials(df,date_start,date_end,origin="BOS",query="NumFlights",scope="airports"):
+    coordinates = ["ORIGIN_LATITUDE","ORIGIN_LONGITUDE","DEST_LATITUDE","DEST_LONGITUDE"]
+    keys = ["Origin","Dest","ORIGIN_STATE","DEST_STATE"]+coordinates
+    merged = daily_partials(df,"routes "+origin,days_between(date_start,date_end),keys,["ArrDelay"],
+                                col("Origin") == origin)
+    merged = merged.rename(columns={"count": "NumFlights"})
+    return shape_routes(merged,query,scope)
+
+# the routes of routes_queries from the flights and the sum of the arrival
+# delays of every (Origin, Dest) with its attributes
+
+def shape_routes(merged,query="NumFlights",scope="airports"):
+    coordinates = ["ORIGIN_LATITUDE","ORIGIN_LONGITUDE","DEST_LATITUDE","DEST_LONGITUDE"]
+    if scope != "airports":
+        # the coordinates of a state are the mean of its airports, weighted
+        # by the number of flights
+        for coordinate in coordinates:
+            merged[coordinate] = merged[coordinate]*merged["NumFlights"]
+        merged = merged.groupby(["ORIGIN_STATE","DEST_STATE"],as_index=False)[["NumFlights","ArrDelay"]+coordinates].sum()
+        for coordinate in coordinates:
+            merged[coordinate] = merged[coordinate]/merged["NumFlights"]
+        keys = ["ORIGIN_STATE","DEST_STATE"]+coordinates
+    else:
+        keys = ["Origin","Dest"]+coordinates
+
+    merged["AverageArrivalDelay"] = merged["ArrDelay"]/merged["NumFlights"]
+    merged = merged[keys+["AverageArrivalDelay","NumFlights"]]
+    return merged.sort_values(by=query,ascending=False).reset_index(drop=True)
+
+def x_places_from_partials(flights_df, x, start_month, end_month, start_day, end_day, place_attribute, sort_by, start_year=None, end_year=None):
+    merged = daily_partials(flights_df, "places " + place_attribute,
+                            days_in_window(start_month, end_month, start_day, end_day, start_year, end_year),
+                            [place_attribute], [])
+    places = merged.sort_values(by="count", ascending=(sort_by != "Top")).head(x)
+    return places.rename(columns={"count": "Count"}).reset_index(drop=True)
+
+composable_queries = {origin_dest_query: origin_dest_from_partials,
+                      routes_queries: routes_from_partials,
+                      compute_x_places_by_interval: x_places_from_partials}
+
+
+###### BATCH QUERIES ########
+
+# grouping columns and measures (alias, kind, column) of the queries that can
+# share a scan with other queries (their specs have no filters, order or
+# limit), None for the others
+
+batch_specs = {matrix_agg: matrix_spec, states_map_query: states_map_spec, scatter_queries: scatter_spec}
+
+def batch_spec(query, args):
+    if query not in batch_specs:
+        return None
+    spec = batch_specs[query](*args)
+    return list(spec.keys), list(spec.measures)
+
+batch_views = itertools.count()
+pandas_int_types = {"byte": "int8", "short": "int16", "integer": "int32", "long": "int64"}
+
+# run several aggregations specs (grouping columns, measures) with a single
+# scan of the data, grouping by GROUPING SETS, and split the result per spec.
+# The result of every spec is the same pandas dataframe its query would give
+
+def batch_query(df, specs):
+    columns = []
+    for keys, measures in specs:
+        columns += [key for key in keys if key not in columns]
+    measure_columns = []
+    for keys, measures in specs:
+        measure_columns += [column for _, _, column in measures
+                                if column is not None and column not in columns + measure_columns]
+    source, from_cube = get_source(df, columns + measure_columns)
+
+    expressions = {}
+    for keys, measures in specs:
+        for alias, kind, column in measures:
+            expression = measure_sql(kind, column, from_cube)
+            if expressions.setdefault(alias, expression) != expression:
+                raise ValueError("different measures with the same name: " + alias)
+
+    grouping_sets = []
+    for keys, measures in specs:
+        if keys not in grouping_sets:
+            grouping_sets.append(keys)
+
+    view = "batch_" + str(next(batch_views))
+    project(source, columns + measure_columns, from_cube).createOrReplaceTempView(view)
+    quoted = lambda names: ", ".join(f"`{name}`" for name in names)
+    aggregated = spark.sql(f"SELECT {quoted(columns)}, grouping_id() AS `grouping_id`, " +
+                            ", ".join(f"{expression} AS `{alias}`" for alias, expression in expressions.items()) +
+                            f" FROM `{view}` GROUP BY GROUPING SETS (" +
+                            ", ".join(f"({quoted(keys)})" for keys in grouping_sets) + ")")
+    int_columns = {field.name: pandas_int_types[field.dataType.typeName()]
+                    for field in aggregated.schema.fields
+                    if field.dataType.typeName() in pandas_int_types}
+    result = aggregated.toPandas()
+    spark.catalog.dropTempView(view)
+
+    frames = []
+    for keys, measures in specs:
+        # grouping_id has a bit set for every column not in the grouping set,
+        # the first column being the most significant
+        grouping_id = 0
+        for column in columns:
+            grouping_id = grouping_id*2 + (0 if column in keys else 1)
+        frame = result[result["grouping_id"] == grouping_id][keys + [alias for alias, _, _ in measures]]
+        # the grouping columns are null in the rows of the other sets, so
+        # their integers come back as floats
+        frame = frame.astype({key: int_columns[key] for key in keys if key in int_columns})
+        frames.append(frame.reset_index(drop=True))
+    return frames
+
+# compute with shared scans the (query, args) jobs that support it and are
+# not cached yet, storing their results where fetch looks for them. The
+# cube-covered queries and the others are run as two separate batches
+
+def precompute_batch(df, jobs):
+    if result_cache is None or df is not dataset:
+        return 0
+    missing = object()
+    pending = {}
+    for query, args in jobs:
+        spec = batch_spec(query, args)
+        if spec is not None and result_cache.get(query_key(query, args), missing) is missing:
+            pending[query_key(query, args)] = spec
+    mine, others = result_cache.claim(list(pending))
+
+    batches = {}
+    for key in mine:
+        keys, measures = pending[key]
+        _, from_cube = get_source(df, keys + [column for _, _, column in measures if column is not None])
+        batches.setdefault(from_cube, []).append(key)
+    released = set()
+    try:
+        for batch in batches.values():
+            frames = batch_query(df, [pending[key] for key in batch])
+            for key, frame in zip(batch, frames):
+                result_cache.put(key, frame)
+                result_cache.release(key, frame)
+                released.add(key)
+    except Exception as error:
+        for key in mine:
+            if key not in released:
+                result_cache.release(key, error=error)
+        raise
+    return len(mine)
@@ -0,0 +1,189 @@
+###### IMPORTS ########
+
+import json
+import os
+import sys
+from urllib.parse import unquote, urlparse
+import pandas as pd
+import pyspark.sql.functions as F
+from pyspark.sql.types import StructType
+
+###### CONSTANTS ########
+
+# the cleaned csv of every year (cleaned_flights.csv is 2013), read together
+csv_path = "data.nosync/cleaned/cleaned_flights*.csv"
+parquet_path = "data.nosync/cleaned/cleaned_flights.parquet"
+schema_path = "util/schema.json"
+# monthly files downloaded from the BTS, before the cleaning of the preprocessing
+raw_path = "data.nosync/*.csv"
+airlines_cancelled_diverted_path = "util/airlines_cancelled_diverted.csv"
+
+# the date-range filters are translated into predicates on these columns,
+# so Spark reads only the partitions inside the selected period
+partition_columns = ["Year", "Month"]
+
+# inside a partition the rows are clustered by origin and date, so the files
+# of a month cover few airports each: the point-origin queries read only the
+# files whose min/max statistics can contain the airport
+cluster_columns = ["Origin", "FlightDate"]
+files_per_partition = 8
+
+# min/max of these columns are kept per file, in a csv next to the parquet
+# files (Spark ignores the names starting with _)
+stats_columns = ["Origin", "Dest", "ORIGIN_STATE", "DEST_STATE",
+                 "ORIGIN_STATE_FULL_NAME", "DEST_STATE_FULL_NAME", "FlightDate"]
+stats_file = "_file_stats.csv"
+
+###### FUNCTIONS ########
+
+def load_schema():
+    with open(schema_path, "r") as f:
+        schema = StructType.fromJson(json.load(f))
+    return schema
+
+def read_csv(spark, path=csv_path):
+    return spark.read.csv(path, schema=load_schema(), header=True)
+
+def read_parquet(spark, path=parquet_path):
+    return spark.read.parquet(path)
+
+def parquet_exists(path=parquet_path):
+    return os.path.isdir(path)
+
+# z-order value of the place columns: the bits of the ranks of their values
+# interleaved, so the rows close in every column end up in the same files
+
+def z_value(df, columns):
+    ranks = []
+    for column in columns:
+        values = sorted(row[0] for row in df.select(column).distinct().collect() if row[0] is not None)
+        mapping = F.create_map(*[F.lit(item) for rank, value in enumerate(values) for item in (value, rank)])
+        ranks.append((F.coalesce(mapping[F.col(column)], F.lit(0)).cast("long"), max(len(values) - 1, 1).bit_length()))
+    bits = max(length for _, length in ranks)
+    z = F.lit(0).cast("long")
+    for bit in range(bits):
+        for position, (rank, _) in enumerate(ranks):
+            value = F.shiftright(rank, bit).bitwiseAND(1)
+            z = z.bitwiseOR(F.shiftleft(value, bit*len(ranks) + len(ranks) - 1 - position))
+    return z
+
+# conversion step: the cleaned csv is parsed once and written as parquet
+# partitioned by Year and Month, with the rows of every partition range
+# partitioned and sorted by cluster_columns (or by the z-order of the zorder
+# columns, then by date). The statistics of the written files are saved too
+
+def write_parquet(df, path=parquet_path, mode="overwrite", zorder=None):
+    if zorder:
+        df = df.withColumn("_zorder", z_value(df, zorder))
+        order = ["_zorder", "FlightDate"]
+    else:
+        order = cluster_columns
+    months = df.select(*partition_columns).distinct().count()
+    df.repartitionByRange(months*files_per_partition, *partition_columns, *order).\
+        sortWithinPartitions(*partition_columns, *order).\
+        drop("_zorder").\
+        write.\
+        mode(mode).\
+        partitionBy(*partition_columns).\
+        parquet(path)
+    write_file_stats(df.sparkSession, path)
+
+# rows, bytes and min/max of stats_columns of every file of the dataset,
+# with the paths relative to the dataset
+
+def file_stats(spark, path=parquet_path):
+    aggregations = [F.count(F.lit(1)).alias("rows")]
+    for column in stats_columns:
+        aggregations += [F.min(column).alias(column + "_min"), F.max(column).alias(column + "_max")]
+    stats = read_parquet(spark, path).\
+                groupBy(F.input_file_name().alias("file")).\
+                agg(*aggregations).\
+                toPandas()
+    stats["file"] = [os.path.relpath(unquote(urlparse(file).path), path) for file in stats["file"]]
+    stats["bytes"] = [os.path.getsize(os.path.join(path, file)) for file in stats["file"]]
+    return stats.sort_values(by="file").reset_index(drop=True)
+
+def write_file_stats(spark, path=parquet_path):
+    stats = file_stats(spark, path)
+    stats.to_csv(os.path.join(path, stats_file), index=False)
+    return stats
+
+def load_file_stats(path=parquet_path):
+    stats_path = os.path.join(path, stats_file)
+    if not os.path.isfile(stats_path):
+        return None
+    stats = pd.read_csv(stats_path)
+    for bound in ["_min", "_max"]:
+        stats["FlightDate" + bound] = pd.to_datetime(stats["FlightDate" + bound])
+    return stats
+
+# mask of the files that can contain rows inside the bounds: column -> list of
+# (low, high) intervals, of which a row must match at least one per column.
+# The columns without statistics don't exclude any file
+
+def files_matching(stats, bounds):
+    keep = pd.Series(True, index=stats.index)
+    for column, intervals in bounds.items():
+        if column + "_min" not in stats:
+            continue
+        low_column, high_column = stats[column + "_min"], stats[column + "_max"]
+        if column == "FlightDate":
+            intervals = [(pd.Timestamp(low), pd.Timestamp(high)) for low, high in intervals]
+        matching = pd.Series(False, index=stats.index)
+        for low, high in intervals:
+            matching |= (low_column <= high) & (high_column >= low)
+        keep &= matching
+    return keep
+
+def skipping_report(stats, keep):
+    return {"files": len(stats), "skipped_files": int((~keep).sum()),
+            "bytes": int(stats["bytes"].sum()), "skipped_bytes": int(stats.loc[~keep, "bytes"].sum())}
+
+# the dataset restricted to some of its files, with the partition columns
+# still read from the paths
+
+def read_files(spark, files, path=parquet_path):
+    if not files:
+        return read_parquet(spark, path).where(F.lit(False))
+    return spark.read.option("basePath", path).parquet(*[os.path.join(path, file) for file in files])
+
+def convert_csv_to_parquet(spark, source=csv_path, destination=parquet_path):
+    df = read_csv(spark, source)
+    write_parquet(df, destination)
+    return read_parquet(spark, destination)
+
+# the cleaned dataset has no cancelled or diverted flights, so they are counted
+# per day and airline on the raw files. The result is a few thousand rows
+
+def write_airlines_cancelled_diverted(spark, source=raw_path, destination=airlines_cancelled_diverted_path):
+    raw = spark.read.csv(source, header=True)
+    daily = raw.groupBy(F.to_date("FlightDate").alias("FlightDate"), "Reporting_Airline").\
+                agg(F.sum(F.col("Cancelled").cast("double")).alias("Cancelled"),
+                    F.sum(F.col("Diverted").cast("double")).alias("Diverted")).\
+                orderBy("FlightDate", "Reporting_Airline").\
+                toPandas()
+    daily.to_csv(destination, index=False)
+    return daily
+
+
+##### CONVERSION RUN #######
+
+# python storage_api.py [csv path] [parquet path]
+# python storage_api.py zorder [column ...]
+# python storage_api.py cancellations [raw files]
+if __name__ == "__main__":
+    from spark_api import spark
+
+    if len(sys.argv) > 1 and sys.argv[1] == "zorder":
+        zorder = sys.argv[2:] or ["Origin", "Dest"]
+        write_parquet(read_csv(spark), zorder=zorder)
+        print("written", parquet_path, "z-ordered by", ", ".join(zorder))
+    elif len(sys.argv) > 1 and sys.argv[1] == "cancellations":
+        source = sys.argv[2] if len(sys.argv) > 2 else raw_path
+        write_airlines_cancelled_diverted(spark, source)
+        print("written", airlines_cancelled_diverted_path)
+    else:
+        source = sys.argv[1] if len(sys.argv) > 1 else csv_path
+        destination = sys.argv[2] if len(sys.argv) > 2 else parquet_path
+        convert_csv_to_parquet(spark, source, destination)
+        print("written", destination)
@@ -0,0 +1,144 @@
+###### IMPORTS ########
+
+import argparse
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from executor_api import background_pool, in_pool
+from spark_api import compute_flights_per_selected_place, compute_mean_arr_delay_per_dest, compute_mean_dep_delay_per_origin, compute_x_places_by_interval, fetch, get_dates, get_years, \
+                    load_cache, load_dataset, matrix_agg, origin_dest_query, precompute_batch, scatter_queries, states_map_query, use_dataset
+
+###### CONSTANTS ########
+
+# popular states precomputed after the defaults of the widgets
+heatmap_x_axes = ["Month", "DepTimeBlk", "ArrTimeBlk"]
+heatmap_queries = ["count", "ArrDelay"]
+scatter_granularities = ["FlightDate", "Month", "DayOfWeek"]
+# places of the pie, histogram and facet widgets
+places_shown = 10
+workers = 4
+
+# progress of the last warm-up, read by the app at /warmup-progress, with the
+# messages of the last max_errors failures
+progress = {"total": 0, "done": 0, "failed": 0, "running": False, "seconds": 0.0, "errors": []}
+progress_lock = threading.Lock()
+max_errors = 20
+
+logger = logging.getLogger(__name__)
+
+###### FUNCTIONS ########
+
+# (query, arguments) of the default state of every widget of app.py, with the
+# arguments the callbacks pass to fetch
+
+def default_jobs():
+    dates = get_dates()
+    first, last = dates[0], dates[len(dates) - 1]
+    years = get_years()
+    first_year, last_year = years[0], years[len(years) - 1]
+    return [
+        (matrix_agg, ("Month", "DayOfWeek", "count")),
+        (origin_dest_query, (first, last, "count")),
+        (states_map_query, ("ORIGIN_STATE",)),
+        (states_map_query, ("DEST_STATE",)),
+        (scatter_queries, ("FlightDate",)),
+        # the daily partials of the places, shared by the pie and histogram widgets
+        (compute_x_places_by_interval, (places_shown, 1, 12, 1, 31, "DEST_STATE_FULL_NAME", "Top", first_year, last_year)),
+        (compute_mean_arr_delay_per_dest, ("Utah", "DEST_STATE_FULL_NAME", "Daily")),
+        (compute_mean_dep_delay_per_origin, ("Utah", "ORIGIN_STATE_FULL_NAME", "Daily")),
+        (compute_flights_per_selected_place, ("ORIGIN_STATE_FULL_NAME", "Utah")),
+    ]
+
+# every heatmap axis and every granularity of the scatter plot (the routes
+# map is answered by the adjacency of the routes, see use_indexes)
+
+def popular_jobs():
+    jobs = [(matrix_agg, (x, "DayOfWeek", z)) for x in heatmap_x_axes for z in heatmap_queries]
+    jobs += [(scatter_queries, (granularity,)) for granularity in scatter_granularities]
+    return jobs
+
+def get_progress():
+    with progress_lock:
+        return dict(progress, errors=list(progress["errors"]))
+
+def update_progress(**changes):
+    with progress_lock:
+        for name, value in changes.items():
+            progress[name] = value
+
+def count_progress(name):
+    with progress_lock:
+        progress[name] += 1
+
+# log a failure of the warm-up and record it in the progress
+
+def report_error(message, error):
+    logger.warning("%s: %r", message, error, exc_info=error)
+    with progress_lock:
+        progress["errors"] = (progress["errors"] + [f"{message}: {error!r}"])[-max_errors:]
+
+# run the jobs through fetch with a bounded pool of threads (Spark runs the
+# jobs of different threads concurrently, in the background scheduler pool), so the results end up in the cache.
+# The jobs that can share a scan are computed first in a single batch
+
+def run_jobs(df, jobs, max_workers=workers):
+    try:
+        in_pool(background_pool, precompute_batch, df, jobs)
+    except Exception as error:
+        report_error("batch warm-up failed", error)
+
+    def run(query, args):
+        in_pool(background_pool, fetch, query, df, *args)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="warmup") as pool:
+        futures = {pool.submit(run, query, args): query.__name__ for query, args in jobs}
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                count_progress("failed")
+                report_error("warm-up of " + futures[future] + " failed", future.exception())
+            else:
+                count_progress("done")
+
+def warmup(df, cache, max_workers=workers):
+    start = time.perf_counter()
+    update_progress(total=0, done=0, failed=0, running=True, seconds=0.0, errors=[])
+    try:
+        # the defaults first, so the first page load is served from the cache
+        jobs = default_jobs()
+        update_progress(total=len(jobs))
+        run_jobs(df, jobs, max_workers)
+        jobs = popular_jobs()
+        update_progress(total=get_progress()["total"] + len(jobs))
+        run_jobs(df, jobs, max_workers)
+        cache.flush()
+    except Exception as error:
+        report_error("warm-up failed", error)
+    finally:
+        # the warm-up always ends, even when it fails
+        update_progress(running=False, seconds=time.perf_counter() - start)
+    return get_progress()
+
+# warm-up in the background, while the app is already serving
+
+def start_warmup(df, cache, max_workers=workers):
+    thread = threading.Thread(target=warmup, args=(df, cache, max_workers),
+                              name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+##### WARM-UP RUN #######
+
+# python warmup.py [--workers N]
+# fills util/cache.sqlite, that the app reads at the next start
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the results of the dashboard widgets")
+    parser.add_argument("--workers", type=int, default=workers, help="number of queries run at the same time")
+    arguments = parser.parse_args()
+
+    df = load_dataset()
+    cache = load_cache()
+    use_dataset(df, cache)
+    print(warmup(df, cache, arguments.workers))